@@ -2,4 +2,23 @@
 LoRA Captioner - Automatic image captioning for LoRA training datasets.
 """
 
+import importlib.util
+import os
+
 __version__ = "0.1.0"
+
+# CUDA allocator defaults, applied before any submodule imports torch.
+# Expandable segments stop mixed-size batches fragmenting the cache into
+# unusable blocks. Setting either variable yourself overrides this.
+_ALLOC_CONF_DEFAULT = "expandable_segments:True,max_split_size_mb:128"
+
+if "PYTORCH_ALLOC_CONF" not in os.environ and "PYTORCH_CUDA_ALLOC_CONF" not in os.environ:
+    # PYTORCH_ALLOC_CONF is the current name; older torch only reads the CUDA one
+    os.environ["PYTORCH_ALLOC_CONF"] = _ALLOC_CONF_DEFAULT
+    os.environ["PYTORCH_CUDA_ALLOC_CONF"] = _ALLOC_CONF_DEFAULT
+
+# Parallel model downloads through hf_transfer when it is installed. Set here
+# because huggingface_hub reads the flag once, when it is first imported; it
+# refuses to download if the flag is on but the package is missing.
+if importlib.util.find_spec("hf_transfer") is not None:
+    os.environ.setdefault("HF_HUB_ENABLE_HF_TRANSFER", "1")
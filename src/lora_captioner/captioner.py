@@ -6,12 +6,20 @@ Supports multiple models:
 - Florence-2: Better for LoRA training, requires transformers<=4.51.3
 """
 
+import os
+from concurrent.futures import ThreadPoolExecutor
 from enum import Enum
 from pathlib import Path
+from typing import Iterator
 
+import numpy as np
 import torch
+import torch.nn.functional as F
 from PIL import Image
 
+from lora_captioner.image_processor import load_image
+from lora_captioner.model_manager import uncompile_model
+
 
 class LoRAType(str, Enum):
     """Types of LoRA training."""
@@ -20,6 +28,18 @@ class LoRAType(str, Enum):
     CONCEPT = "concept"
 
 
+# Number of images sent through the processor and model per generate call
+DEFAULT_BATCH_SIZE = 8
+
+# BLIP beam search width; greedy decoding (1) is ~3x faster than 3 beams
+DEFAULT_NUM_BEAMS = 1
+
+# Threads decoding the next batch's images while the current batch generates
+PREFETCH_WORKERS = 4
+
+# Set to "1" to resize and normalize images on the GPU instead of in the processor
+GPU_PREPROCESS_ENV_VAR = "LORA_CAPTIONER_GPU_PREPROCESS"
+
 # BLIP prompts (conditional captioning)
 BLIP_PROMPTS = {
     LoRAType.CHARACTER: "a photo of",
@@ -34,6 +54,17 @@ FLORENCE_INSTRUCTIONS = {
     LoRAType.CONCEPT: "<DETAILED_CAPTION>",
 }
 
+# Florence-2 generation budget per LoRA type. Captions are usually 30-100
+# tokens; the cap only bounds runs where the model never emits EOS.
+FLORENCE_MAX_NEW_TOKENS = {
+    LoRAType.CHARACTER: 512,  # <MORE_DETAILED_CAPTION>
+    LoRAType.STYLE: 256,  # <GENERATE_TAGS>
+    LoRAType.CONCEPT: 256,  # <DETAILED_CAPTION>
+}
+
+# BLIP captions are short single sentences
+BLIP_MAX_NEW_TOKENS = 100
+
 
 def get_blip_prompt(lora_type: LoRAType) -> str:
     """Get BLIP conditional prompt for a LoRA type."""
@@ -45,6 +76,209 @@ def get_florence_instruction(lora_type: LoRAType) -> str:
     return FLORENCE_INSTRUCTIONS.get(lora_type, FLORENCE_INSTRUCTIONS[LoRAType.STYLE])
 
 
+def get_florence_max_new_tokens(lora_type: LoRAType) -> int:
+    """Get the Florence-2 max_new_tokens budget for a LoRA type."""
+    return FLORENCE_MAX_NEW_TOKENS.get(lora_type, FLORENCE_MAX_NEW_TOKENS[LoRAType.STYLE])
+
+
+def _autocast(device: str, dtype: torch.dtype):
+    """Autocast context for reduced-precision inference on CUDA (no-op elsewhere)."""
+    device_type = torch.device(device).type
+    enabled = device_type == "cuda" and dtype in (torch.float16, torch.bfloat16)
+    return torch.autocast(device_type=device_type, dtype=dtype, enabled=enabled)
+
+
+def _model_dtype(model) -> torch.dtype:
+    """Get the model's weight dtype, cached on the model after the first lookup."""
+    dtype = getattr(model, "_cached_dtype", None)
+    if dtype is None:
+        dtype = next(model.parameters()).dtype
+        model._cached_dtype = dtype
+    return dtype
+
+
+# PIL resample filters the on-device resize can reproduce
+_DEVICE_RESIZE_MODES = {
+    Image.Resampling.BILINEAR: "bilinear",
+    Image.Resampling.BICUBIC: "bicubic",
+}
+
+
+def _device_preprocess_config(image_processor) -> tuple[tuple[int, int], str] | None:
+    """
+    Get (size, interpolation mode) if the processor's transform can run on the GPU.
+    
+    Covers resize + rescale + normalize, which is what the BLIP and Florence-2
+    processors do. Processors that also center-crop (or are configured in some
+    other way) return None and keep the CPU path.
+    """
+    size = getattr(image_processor, "size", None) or {}
+    mode = _DEVICE_RESIZE_MODES.get(getattr(image_processor, "resample", None))
+    
+    if (
+        mode is None
+        or "height" not in size
+        or "width" not in size
+        or not getattr(image_processor, "do_resize", False)
+        or not getattr(image_processor, "do_rescale", False)
+        or not getattr(image_processor, "do_normalize", False)
+        or getattr(image_processor, "do_center_crop", False)
+    ):
+        return None
+    
+    return (size["height"], size["width"]), mode
+
+
+class _PixelStager:
+    """
+    Turns batches of images into model-ready pixel values on the device.
+    
+    By default the image processor writes NumPy arrays, which are cast into a
+    pinned host buffer and copied asynchronously to the device. With
+    LORA_CAPTIONER_GPU_PREPROCESS=1 on CUDA, images are instead uploaded as
+    uint8 through the same kind of pinned buffer and resized and normalized
+    on the GPU, when the processor's transform allows it (see
+    _device_preprocess_config). Buffers are reused across batches (grown only
+    when a larger batch arrives), so the captioning loop makes no per-batch
+    allocations and the model sees its input at a stable device address, as
+    CUDA graph replay prefers.
+    """
+    
+    def __init__(
+        self,
+        image_processor,
+        device: str,
+        dtype: torch.dtype,
+        device_preprocess: bool | None = None,
+    ):
+        self.image_processor = image_processor
+        self.device = device
+        self.dtype = dtype
+        self.on_cuda = torch.device(device).type == "cuda"
+        self._host_buffer: torch.Tensor | None = None
+        self._device_buffer: torch.Tensor | None = None
+        self._host_bytes: torch.Tensor | None = None
+        self._device_bytes: torch.Tensor | None = None
+        self._copy_done = None  # CUDA event for the last copy out of a host buffer
+        
+        # None follows the environment; tests pass True to run it on the CPU
+        if device_preprocess is None:
+            device_preprocess = self.on_cuda and os.environ.get(GPU_PREPROCESS_ENV_VAR) == "1"
+        
+        self._device_config = (
+            _device_preprocess_config(image_processor) if device_preprocess else None
+        )
+        if self._device_config is not None:
+            # Rescale and normalize folded into one multiply-add per channel
+            scale = image_processor.rescale_factor
+            mean = torch.tensor(image_processor.image_mean, device=device).view(3, 1, 1)
+            std = torch.tensor(image_processor.image_std, device=device).view(3, 1, 1)
+            self._norm_scale = scale / std
+            self._norm_shift = -mean / std
+    
+    def __call__(self, images: list[Image.Image]) -> torch.Tensor:
+        if self._device_config is not None:
+            return self._preprocess_on_device(images)
+        
+        pixel_values = self.image_processor(images, return_tensors="np")["pixel_values"]
+        batch = torch.from_numpy(pixel_values)
+        
+        if not self.on_cuda:
+            return batch.to(self.dtype)
+        
+        self._wait_for_copy()
+        
+        self._host_buffer = self._fit(self._host_buffer, batch.shape, pin_memory=True)
+        host = self._host_buffer[:batch.shape[0]]
+        # Casts and reorders to channels_last on the host, so half-precision
+        # runs move half the bytes and the device copy is a straight memcpy
+        host.copy_(batch)
+        
+        # Writes to the device buffer are stream-ordered after the previous
+        # batch's generate(), so it can be reused without synchronizing
+        self._device_buffer = self._fit(self._device_buffer, batch.shape, device=self.device)
+        pixel_values = self._device_buffer[:batch.shape[0]]
+        pixel_values.copy_(host, non_blocking=True)
+        self._record_copy()
+        
+        # channels_last matches the vision encoder set up by load_model
+        return pixel_values
+    
+    def _preprocess_on_device(self, images: list[Image.Image]) -> torch.Tensor:
+        """Resize and normalize on the device, matching the processor's CPU output."""
+        (height, width), mode = self._device_config
+        images = [image if image.mode == "RGB" else image.convert("RGB") for image in images]
+        
+        # Pack the whole batch as uint8 into one pinned buffer, a quarter of
+        # the bytes of float32 pixel values, and upload it in a single copy
+        sizes = [image.width * image.height * 3 for image in images]
+        total = sum(sizes)
+        
+        self._wait_for_copy()
+        self._host_bytes = self._fit_bytes(self._host_bytes, total, pin_memory=self.on_cuda)
+        host = self._host_bytes.numpy()
+        offset = 0
+        for image, size in zip(images, sizes, strict=True):
+            np.copyto(host[offset:offset + size].reshape(image.height, image.width, 3), image)
+            offset += size
+        
+        self._device_bytes = self._fit_bytes(self._device_bytes, total, device=self.device)
+        device_bytes = self._device_bytes[:total]
+        device_bytes.copy_(self._host_bytes[:total], non_blocking=True)
+        self._record_copy()
+        
+        shape = torch.Size((len(images), 3, height, width))
+        self._device_buffer = self._fit(self._device_buffer, shape, device=self.device)
+        pixel_values = self._device_buffer[:len(images)]
+        
+        offset = 0
+        for i, (image, size) in enumerate(zip(images, sizes, strict=True)):
+            pixels = device_bytes[offset:offset + size].view(image.height, image.width, 3)
+            offset += size
+            pixels = pixels.permute(2, 0, 1).unsqueeze(0).float()
+            
+            # PIL resizes uint8 images one axis at a time, width first, and
+            # rounds and clamps in between; doing the same keeps bicubic
+            # overshoot at sharp edges within a level or two of the processor
+            pixels = _resize_uint8(pixels, (image.height, width), mode)
+            pixels = _resize_uint8(pixels, (height, width), mode)
+            pixel_values[i] = pixels[0] * self._norm_scale + self._norm_shift
+        
+        return pixel_values
+    
+    def _wait_for_copy(self) -> None:
+        """Wait out any copy still reading a host buffer before it is overwritten."""
+        if self._copy_done is not None:
+            self._copy_done.synchronize()
+    
+    def _record_copy(self) -> None:
+        """Mark the end of the copy just queued out of a host buffer."""
+        if self.on_cuda:
+            self._copy_done = torch.cuda.Event()
+            self._copy_done.record()
+    
+    def _fit(self, buffer: torch.Tensor | None, shape: torch.Size, **kwargs) -> torch.Tensor:
+        """Reuse a buffer if it can hold a batch of the given shape, else allocate one."""
+        if buffer is not None and buffer.shape[0] >= shape[0] and buffer.shape[1:] == shape[1:]:
+            return buffer
+        return torch.empty(shape, dtype=self.dtype, memory_format=torch.channels_last, **kwargs)
+    
+    @staticmethod
+    def _fit_bytes(buffer: torch.Tensor | None, size: int, **kwargs) -> torch.Tensor:
+        """Reuse a flat uint8 buffer if it holds at least size bytes, else allocate one."""
+        if buffer is not None and buffer.numel() >= size:
+            return buffer
+        return torch.empty(size, dtype=torch.uint8, **kwargs)
+
+
+def _resize_uint8(pixels: torch.Tensor, size: tuple[int, int], mode: str) -> torch.Tensor:
+    """Resize a float NCHW tensor holding uint8 values, rounding back to uint8 levels."""
+    if tuple(pixels.shape[-2:]) == size:
+        return pixels
+    pixels = F.interpolate(pixels, size=size, mode=mode, antialias=True)
+    return pixels.round_().clamp_(0, 255)
+
+
 def caption_image(
     image_path: Path,
     model,
@@ -53,6 +287,8 @@ def caption_image(
     lora_type: LoRAType,
     trigger_word: str | None = None,
     model_type: str = "blip",
+    num_beams: int = DEFAULT_NUM_BEAMS,
+    max_new_tokens: int | None = None,
 ) -> str:
     """
     Generate a caption for a single image.
@@ -65,91 +301,407 @@ def caption_image(
         lora_type: Type of LoRA being trained
         trigger_word: Optional trigger word to prepend
         model_type: Type of model ("blip" or "florence")
+        num_beams: Beam search width for BLIP (Florence-2 always decodes greedily)
+        max_new_tokens: Generation length cap (default: per model and LoRA type)
+        
+    Returns:
+        Generated caption string
+    """
+    return caption_pil_image(
+        load_image(image_path), model, processor, device, lora_type,
+        trigger_word=trigger_word, model_type=model_type,
+        num_beams=num_beams, max_new_tokens=max_new_tokens,
+    )
+
+
+@torch.inference_mode()
+def caption_pil_image(
+    image: Image.Image,
+    model,
+    processor,
+    device: str,
+    lora_type: LoRAType,
+    trigger_word: str | None = None,
+    model_type: str = "blip",
+    num_beams: int = DEFAULT_NUM_BEAMS,
+    max_new_tokens: int | None = None,
+) -> str:
+    """
+    Generate a caption for an image that is already in memory.
+    
+    Runs under torch.inference_mode(), so callers need no no_grad() of their own.
+    
+    Args:
+        image: RGB PIL image
+        model: Loaded model (BLIP or Florence-2)
+        processor: Model processor
+        device: Device string (e.g., "cuda:0" or "cpu")
+        lora_type: Type of LoRA being trained
+        trigger_word: Optional trigger word to prepend
+        model_type: Type of model ("blip" or "florence")
+        num_beams: Beam search width for BLIP (Florence-2 always decodes greedily)
+        max_new_tokens: Generation length cap (default: per model and LoRA type)
         
     Returns:
         Generated caption string
     """
-    # Load image
-    image = Image.open(image_path).convert("RGB")
+    return caption_images(
+        [image], model, processor, device, lora_type,
+        trigger_word=trigger_word, model_type=model_type, batch_size=1,
+        num_beams=num_beams, max_new_tokens=max_new_tokens,
+    )[0]
+
+
+@torch.inference_mode()
+def caption_images(
+    images: list[Image.Image],
+    model,
+    processor,
+    device: str,
+    lora_type: LoRAType,
+    trigger_word: str | None = None,
+    model_type: str = "blip",
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    num_beams: int = DEFAULT_NUM_BEAMS,
+    max_new_tokens: int | None = None,
+) -> list[str]:
+    """
+    Generate captions for images that are already in memory, in batches.
     
-    if model_type.lower() == "florence":
-        caption = _caption_with_florence(image, model, processor, device, lora_type)
-    else:
-        caption = _caption_with_blip(image, model, processor, device, lora_type)
+    The in-memory counterpart of caption_batch: each generate call handles
+    up to batch_size images, which costs far less per image than captioning
+    them one at a time.
+    
+    Args:
+        images: PIL images
+        model: Loaded model (BLIP or Florence-2)
+        processor: Model processor
+        device: Device string (e.g., "cuda:0" or "cpu")
+        lora_type: Type of LoRA being trained
+        trigger_word: Optional trigger word to prepend
+        model_type: Type of model ("blip" or "florence")
+        batch_size: Number of images per generate call
+        num_beams: Beam search width for BLIP (Florence-2 always decodes greedily)
+        max_new_tokens: Generation length cap (default: per model and LoRA type)
+        
+    Returns:
+        Captions in the same order as images
+    """
+    if batch_size < 1:
+        raise ValueError(f"batch_size must be at least 1, got {batch_size}")
+    
+    encode_fn, caption_fn = _get_caption_backend(model_type)
+    prompt_inputs = encode_fn(processor, device, lora_type)
+    pixel_stager = _PixelStager(processor.image_processor, device, _model_dtype(model))
+    pad_batches = getattr(model, "_is_compiled", False)
+    
+    captions = []
+    for start in range(0, len(images), batch_size):
+        batch = [
+            image if image.mode == "RGB" else image.convert("RGB")
+            for image in images[start:start + batch_size]
+        ]
+        count = len(batch)
+        
+        # Keep shapes fixed for compiled models, as iter_captions does
+        if pad_batches and count < batch_size:
+            batch += [batch[-1]] * (batch_size - count)
+        
+        captions.extend(caption_fn(
+            batch, model, processor, device, lora_type, prompt_inputs,
+            num_beams=num_beams, max_new_tokens=max_new_tokens,
+            pixel_stager=pixel_stager,
+        )[:count])
     
     # Prepend trigger word if specified
     if trigger_word:
-        caption = f"{trigger_word}, {caption}"
+        captions = [f"{trigger_word}, {caption}" for caption in captions]
     
-    return caption
+    return captions
+
+
+def _encode_blip_prompt(processor, device: str, lora_type: LoRAType) -> dict:
+    """Tokenize the BLIP conditional prompt once and move it to the device."""
+    text_inputs = processor.tokenizer(
+        get_blip_prompt(lora_type), return_token_type_ids=False, return_tensors="pt"
+    )
+    return {k: v.to(device) for k, v in text_inputs.items()}
+
 
+def _encode_florence_prompt(processor, device: str, lora_type: LoRAType) -> dict:
+    """Tokenize the Florence-2 instruction once and move it to the device."""
+    # The processor expands task tokens like <DETAILED_CAPTION> into a
+    # natural-language prompt before tokenizing
+    prompt = processor._construct_prompts([get_florence_instruction(lora_type)])[0]
+    text_inputs = processor.tokenizer(prompt, return_token_type_ids=False, return_tensors="pt")
+    return {k: v.to(device) for k, v in text_inputs.items()}
 
-def _caption_with_blip(image: Image.Image, model, processor, device: str, lora_type: LoRAType) -> str:
-    """Generate caption using BLIP model."""
-    text_prompt = get_blip_prompt(lora_type)
+
+@torch.inference_mode()
+def _caption_with_blip(
+    images: list[Image.Image],
+    model,
+    processor,
+    device: str,
+    lora_type: LoRAType,
+    prompt_inputs: dict | None = None,
+    num_beams: int = DEFAULT_NUM_BEAMS,
+    max_new_tokens: int | None = None,
+    pixel_stager: _PixelStager | None = None,
+) -> list[str]:
+    """Generate captions for a batch of images using BLIP model."""
+    if prompt_inputs is None:
+        prompt_inputs = _encode_blip_prompt(processor, device, lora_type)
     
-    # Process inputs with conditional text
-    inputs = processor(image, text_prompt, return_tensors="pt").to(device)
+    # Only the images need processing; the prompt is shared by the batch.
+    # repeat() copies, which matters because BLIP's generate() edits input_ids in place
+    inputs = {k: v.repeat(len(images), 1) for k, v in prompt_inputs.items()}
     
-    # Get model dtype and convert pixel values
-    model_dtype = next(model.parameters()).dtype
-    if "pixel_values" in inputs:
-        inputs["pixel_values"] = inputs["pixel_values"].to(model_dtype)
+    # Preprocess images onto the device in the model's dtype
+    model_dtype = _model_dtype(model)
+    if pixel_stager is None:
+        pixel_stager = _PixelStager(processor.image_processor, device, model_dtype)
+    inputs["pixel_values"] = pixel_stager(images)
     
-    # Generate caption
-    with torch.no_grad():
+    # early_stopping only affects beam search
+    beam_kwargs = {"num_beams": num_beams}
+    if num_beams > 1:
+        beam_kwargs["early_stopping"] = True
+    
+    # Generate captions
+    with _autocast(device, model_dtype):
         output = model.generate(
             **inputs,
-            max_new_tokens=100,
-            num_beams=3,
-            early_stopping=True,
+            max_new_tokens=max_new_tokens or BLIP_MAX_NEW_TOKENS,
+            **beam_kwargs,
         )
     
-    # Decode the output
-    caption = processor.decode(output[0], skip_special_tokens=True)
-    return caption.strip()
+    # BLIP echoes the conditional prompt (minus its trailing [SEP]) before the
+    # generated tokens; drop it by position so only new text is decoded
+    prompt_length = prompt_inputs["input_ids"].shape[1] - 1
+    captions = processor.batch_decode(output[:, prompt_length:], skip_special_tokens=True)
+    return [caption.strip() for caption in captions]
 
 
-def _caption_with_florence(image: Image.Image, model, processor, device: str, lora_type: LoRAType) -> str:
-    """Generate caption using Florence-2 model."""
+@torch.inference_mode()
+def _caption_with_florence(
+    images: list[Image.Image],
+    model,
+    processor,
+    device: str,
+    lora_type: LoRAType,
+    prompt_inputs: dict | None = None,
+    num_beams: int = 1,
+    max_new_tokens: int | None = None,
+    pixel_stager: _PixelStager | None = None,
+) -> list[str]:
+    """
+    Generate captions for a batch of images using Florence-2 model.
+    
+    num_beams is accepted to share BLIP's signature but ignored: Florence-2
+    always decodes greedily.
+    """
     instruction = get_florence_instruction(lora_type)
+    if prompt_inputs is None:
+        prompt_inputs = _encode_florence_prompt(processor, device, lora_type)
     
-    # Process inputs
-    inputs = processor(text=instruction, images=image, return_tensors="pt")
+    # Only the images need processing; the prompt is shared by the batch
+    input_ids = prompt_inputs["input_ids"].repeat(len(images), 1)
     
-    # Move to device with correct dtype
-    model_dtype = next(model.parameters()).dtype
-    inputs = {k: v.to(device) for k, v in inputs.items()}
-    if "pixel_values" in inputs:
-        inputs["pixel_values"] = inputs["pixel_values"].to(model_dtype)
+    # Preprocess images onto the device in the model's dtype
+    model_dtype = _model_dtype(model)
+    if pixel_stager is None:
+        pixel_stager = _PixelStager(processor.image_processor, device, model_dtype)
+    pixel_values = pixel_stager(images)
     
-    # Generate caption
-    with torch.no_grad():
+    # Generate captions
+    with _autocast(device, model_dtype):
         generated_ids = model.generate(
-            input_ids=inputs["input_ids"],
-            pixel_values=inputs["pixel_values"],
-            max_new_tokens=1024,
+            input_ids=input_ids,
+            pixel_values=pixel_values,
+            max_new_tokens=max_new_tokens or get_florence_max_new_tokens(lora_type),
+            eos_token_id=processor.tokenizer.eos_token_id,  # Stop as soon as EOS is emitted
             num_beams=1,  # Greedy decoding for compatibility
             do_sample=False,
         )
     
-    # Decode output
-    generated_text = processor.batch_decode(generated_ids, skip_special_tokens=False)[0]
+    # Decode output (shorter sequences in the batch are right-padded)
+    generated_texts = processor.batch_decode(generated_ids, skip_special_tokens=False)
+    pad_token = processor.tokenizer.pad_token
     
-    # Post-process using Florence-2's built-in parser
-    caption = processor.post_process_generation(
-        generated_text,
-        task=instruction,
-        image_size=(image.width, image.height)
-    )
+    captions = []
+    for image, generated_text in zip(images, generated_texts, strict=True):
+        if pad_token:
+            generated_text = generated_text.replace(pad_token, "")
+        
+        # Post-process using Florence-2's built-in parser
+        caption = processor.post_process_generation(
+            generated_text,
+            task=instruction,
+            image_size=(image.width, image.height)
+        )
+        
+        # Handle different output formats from Florence-2
+        if isinstance(caption, dict):
+            caption = caption.get(instruction, "")
+            if isinstance(caption, (dict, list)):
+                caption = str(caption)
+        
+        captions.append(str(caption).strip())
     
-    # Handle different output formats from Florence-2
-    if isinstance(caption, dict):
-        caption = caption.get(instruction, "")
-        if isinstance(caption, (dict, list)):
-            caption = str(caption)
+    return captions
+
+
+# Prompt encoder and batch caption function for each model type
+CAPTION_BACKENDS = {
+    "blip": (_encode_blip_prompt, _caption_with_blip),
+    "florence": (_encode_florence_prompt, _caption_with_florence),
+}
+
+
+def _get_caption_backend(model_type: str):
+    """Get the (encode_prompt, caption) function pair for a model type."""
+    return CAPTION_BACKENDS.get(model_type.lower(), CAPTION_BACKENDS["blip"])
+
+
+def warmup_model(
+    model,
+    processor,
+    device: str,
+    model_type: str = "blip",
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    num_beams: int = DEFAULT_NUM_BEAMS,
+    lora_type: LoRAType = LoRAType.STYLE,
+    max_new_tokens: int | None = None,
+) -> None:
+    """
+    Caption a batch of blank images so compilation happens before real work.
+    
+    Pass the settings of the real run: the prompt length depends on the LoRA
+    type, and any shape that differs from the warmup triggers a recompile.
+    If compilation fails, a warning is printed and the model is switched
+    back to eager execution.
+    
+    Args:
+        model: Loaded model (BLIP or Florence-2)
+        processor: Model processor
+        device: Device string
+        model_type: Type of model ("blip" or "florence")
+        batch_size: Batch size the real run will use
+        num_beams: Beam search width the real run will use (BLIP only)
+        lora_type: LoRA type the real run will use
+        max_new_tokens: Generation length cap the real run will use
+    """
+    images = [Image.new("RGB", (384, 384))] * batch_size
     
-    return str(caption).strip()
+    _, caption_fn = _get_caption_backend(model_type)
+    try:
+        caption_fn(
+            images, model, processor, device, lora_type,
+            num_beams=num_beams, max_new_tokens=max_new_tokens,
+        )
+    except Exception as e:
+        if not getattr(model, "_is_compiled", False):
+            raise
+        # Compiler errors run to pages; the first line names the cause
+        reason = (str(e).strip().splitlines() or [type(e).__name__])[0]
+        print(f"Warning: compiling the model failed ({reason}). Running eagerly.")
+        uncompile_model(model)
+
+
+def iter_captions(
+    image_paths: list[Path],
+    model,
+    processor,
+    device: str,
+    lora_type: LoRAType,
+    model_type: str = "blip",
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    num_beams: int = DEFAULT_NUM_BEAMS,
+    max_new_tokens: int | None = None,
+) -> Iterator[tuple[Path, str | Exception]]:
+    """
+    Generate captions for images, running them through the model in batches.
+    
+    Results are yielded as soon as each batch finishes, so callers can write
+    caption files incrementally. Failures are yielded instead of raised so a
+    single bad image does not abort the run. Captions are yielded without a
+    trigger word; write_caption_file adds it.
+    
+    Args:
+        image_paths: List of image file paths
+        model: Loaded model (BLIP or Florence-2)
+        processor: Model processor
+        device: Device string
+        lora_type: Type of LoRA being trained
+        model_type: Type of model ("blip" or "florence")
+        batch_size: Number of images per generate call
+        num_beams: Beam search width for BLIP (Florence-2 always decodes greedily)
+        max_new_tokens: Generation length cap (default: per model and LoRA type)
+        
+    Yields:
+        (image_path, caption) tuples, or (image_path, exception) on failure
+    """
+    if batch_size < 1:
+        raise ValueError(f"batch_size must be at least 1, got {batch_size}")
+    
+    # Resolve the model-specific functions once, not per batch
+    encode_fn, caption_fn = _get_caption_backend(model_type)
+    
+    # The prompt is the same for every image, so tokenize it once per run,
+    # and stage every batch's pixels through the same reusable buffers
+    prompt_inputs = encode_fn(processor, device, lora_type)
+    pixel_stager = _PixelStager(processor.image_processor, device, _model_dtype(model))
+    
+    # Compiled graphs and CUDA graphs are specialised on input shapes, so a
+    # short final batch would trigger a recompile; pad it to full size instead
+    pad_batches = getattr(model, "_is_compiled", False)
+    
+    batches = [
+        image_paths[start:start + batch_size]
+        for start in range(0, len(image_paths), batch_size)
+    ]
+    
+    with ThreadPoolExecutor(max_workers=PREFETCH_WORKERS) as pool:
+        pending = [pool.submit(load_image, p) for p in batches[0]] if batches else []
+        
+        for index, batch_paths in enumerate(batches):
+            futures = pending
+            
+            # Decode the next batch on CPU while this one runs on the model
+            if index + 1 < len(batches):
+                pending = [pool.submit(load_image, p) for p in batches[index + 1]]
+            
+            # Results are slotted by position so they come out in input order,
+            # with load failures alongside the captions of their batch
+            results: list[str | Exception | None] = [None] * len(batch_paths)
+            images = []
+            loaded = []
+            for i, (_, future) in enumerate(zip(batch_paths, futures, strict=True)):
+                try:
+                    images.append(future.result())
+                    loaded.append(i)
+                except Exception as e:
+                    results[i] = e
+            
+            if images:
+                if pad_batches and len(images) < batch_size:
+                    images = images + [images[-1]] * (batch_size - len(images))
+                
+                try:
+                    captions = caption_fn(
+                        images, model, processor, device, lora_type, prompt_inputs,
+                        num_beams=num_beams, max_new_tokens=max_new_tokens,
+                        pixel_stager=pixel_stager,
+                    )
+                except Exception as e:
+                    captions = [e] * len(loaded)
+                
+                # Non-strict zip() drops captions for any padding images
+                for i, caption in zip(loaded, captions, strict=False):
+                    results[i] = caption
+            
+            yield from zip(batch_paths, results, strict=True)
 
 
 def caption_batch(
@@ -160,18 +712,26 @@ def caption_batch(
     lora_type: LoRAType,
     trigger_word: str | None = None,
     progress_callback=None,
+    model_type: str = "blip",
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    num_beams: int = DEFAULT_NUM_BEAMS,
+    max_new_tokens: int | None = None,
 ) -> list[tuple[Path, str]]:
     """
     Generate captions for a batch of images.
     
     Args:
         image_paths: List of image file paths
-        model: Loaded Moondream2 model
-        processor: Not used (kept for API compatibility)
+        model: Loaded model (BLIP or Florence-2)
+        processor: Model processor
         device: Device string
         lora_type: Type of LoRA being trained
         trigger_word: Optional trigger word to prepend
         progress_callback: Optional callback(current, total) for progress
+        model_type: Type of model ("blip" or "florence")
+        batch_size: Number of images per generate call
+        num_beams: Beam search width for BLIP (Florence-2 always decodes greedily)
+        max_new_tokens: Generation length cap (default: per model and LoRA type)
         
     Returns:
         List of (image_path, caption) tuples
@@ -179,15 +739,18 @@ def caption_batch(
     results = []
     total = len(image_paths)
     
-    for i, image_path in enumerate(image_paths):
-        try:
-            caption = caption_image(
-                image_path, model, processor, device, lora_type, trigger_word
-            )
-            results.append((image_path, caption))
-        except Exception as e:
-            print(f"Error captioning {image_path}: {e}")
-            results.append((image_path, f"ERROR: {e}"))
+    captions = iter_captions(
+        image_paths, model, processor, device, lora_type,
+        model_type=model_type, batch_size=batch_size,
+        num_beams=num_beams, max_new_tokens=max_new_tokens,
+    )
+    for i, (image_path, caption) in enumerate(captions):
+        if isinstance(caption, Exception):
+            print(f"Error captioning {image_path}: {caption}")
+            caption = f"ERROR: {caption}"
+        elif trigger_word:
+            caption = f"{trigger_word}, {caption}"
+        results.append((image_path, caption))
         
         if progress_callback:
             progress_callback(i + 1, total)
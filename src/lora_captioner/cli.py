@@ -3,21 +3,30 @@ Command-line interface for LoRA Captioner.
 """
 
 import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 import click
 from tqdm import tqdm
 
 from lora_captioner import __version__
-from lora_captioner.captioner import LoRAType, caption_image
+from lora_captioner.captioner import (
+    DEFAULT_BATCH_SIZE,
+    DEFAULT_NUM_BEAMS,
+    LoRAType,
+    iter_captions,
+    warmup_model,
+)
 from lora_captioner.image_processor import (
     discover_images,
+    find_uncaptioned_images,
     generate_new_names,
     rename_images,
     write_caption_file,
     create_rename_log,
 )
-from lora_captioner.model_manager import load_model
+from lora_captioner.model_manager import load_model, warmup_cuda
 
 
 @click.command()
@@ -63,6 +72,12 @@ from lora_captioner.model_manager import load_model
     default=False,
     help="Skip renaming images"
 )
+@click.option(
+    "--overwrite",
+    is_flag=True,
+    default=False,
+    help="Re-caption images that already have a caption file (default: skip them)"
+)
 @click.option(
     "--dry-run",
     is_flag=True,
@@ -81,6 +96,39 @@ from lora_captioner.model_manager import load_model
     default="florence",
     help="Model to use: florence (default, better for LoRA) or blip (fallback)"
 )
+@click.option(
+    "-b", "--batch-size",
+    type=click.IntRange(min=1),
+    default=DEFAULT_BATCH_SIZE,
+    show_default=True,
+    help="Number of images captioned per model call"
+)
+@click.option(
+    "--beam-size",
+    type=click.IntRange(min=1),
+    default=DEFAULT_NUM_BEAMS,
+    show_default=True,
+    help="Beam search width for BLIP (1 = greedy, fastest; 3+ = slower, slightly better)"
+)
+@click.option(
+    "--max-new-tokens",
+    type=click.IntRange(min=1),
+    default=None,
+    help="Cap on generated tokens per caption (default: 100 for BLIP, 256-512 for Florence-2)"
+)
+@click.option(
+    "--compile/--no-compile",
+    "compile_model",
+    default=None,
+    help="Compile the model with torch.compile (slow start, faster captioning). "
+         "Default: off unless LORA_CAPTIONER_COMPILE=1 (CUDA only)"
+)
+@click.option(
+    "--quantization",
+    type=click.Choice(["none", "bf16", "int8"], case_sensitive=False),
+    default="none",
+    help="Weight precision: bf16 (also on AVX-512 BF16 CPUs) or int8 (CUDA + bitsandbytes)"
+)
 @click.version_option(version=__version__, prog_name="lora-captioner")
 def main(
     input_path: Path,
@@ -90,9 +138,15 @@ def main(
     output_path: Path | None,
     device: str,
     no_rename: bool,
+    overwrite: bool,
     dry_run: bool,
     recursive: bool,
     model: str,
+    batch_size: int,
+    beam_size: int,
+    max_new_tokens: int | None,
+    compile_model: bool | None,
+    quantization: str,
 ):
     """
     Caption images for LoRA training datasets.
@@ -109,10 +163,14 @@ def main(
     click.echo(f"Trigger word:  {trigger_word or '(none)'}")
     click.echo(f"Device:        {device}")
     click.echo(f"Model:         {model}")
+    click.echo(f"Batch size:    {batch_size}")
     click.echo(f"Rename files:  {'No' if no_rename else 'Yes'}")
     
     if dry_run:
         click.echo("\n[!] DRY RUN MODE - No changes will be made\n")
+    elif device != "cpu":
+        # Overlap CUDA context creation with discovery, renaming and model loading
+        threading.Thread(target=warmup_cuda, daemon=True).start()
     
     # Set output directory
     if output_path is None:
@@ -133,6 +191,11 @@ def main(
     
     click.echo(f"   Found {len(images)} images")
     
+    # Look for captions from a previous run before renaming, while each image
+    # still has its own name; rename_images moves the captions along
+    uncaptioned = set(images) if overwrite else set(find_uncaptioned_images(images))
+    original_images = images
+    
     # Step 2: Rename images (if enabled)
     if not no_rename:
         click.echo("\n[2/4] Renaming images...")
@@ -156,8 +219,26 @@ def main(
         # If output differs from input, we'd need to copy files
         # For now, just work with original paths
     
+    # Skip images captioned by a previous run so reruns only do new work
+    to_caption = [
+        path
+        for original, path in zip(original_images, images, strict=True)
+        if original in uncaptioned
+    ]
+    skipped = len(images) - len(to_caption)
+    if skipped:
+        click.echo(
+            f"\n   Skipping {skipped} images that already have captions "
+            "(--overwrite to redo)"
+        )
+    
+    lora_type_enum = LoRAType(lora_type.lower())
+    
     # Step 3: Load model
-    if not dry_run:
+    if not to_caption:
+        click.echo("\n[3/4] Skipping model load (nothing to caption)")
+        loaded_model, processor, device_str = None, None, "cpu"
+    elif not dry_run:
         click.echo("\n[3/4] Loading captioning model...")
         if model == "florence":
             click.echo("   Model: microsoft/Florence-2-large")
@@ -166,8 +247,20 @@ def main(
         click.echo("   (This may take a moment on first run as the model downloads)")
         
         try:
-            loaded_model, processor, device_str = load_model(device=device, model_type=model)
+            loaded_model, processor, device_str = load_model(
+                device=device,
+                model_type=model,
+                compile_model=compile_model,
+                quantization=quantization.lower(),
+            )
             click.echo(f"   Model loaded on {device_str}")
+            
+            if getattr(loaded_model, "_is_compiled", False):
+                click.echo("   Compiling model (one-time warmup)...")
+                warmup_model(
+                    loaded_model, processor, device_str, model, batch_size, beam_size,
+                    lora_type=lora_type_enum, max_new_tokens=max_new_tokens,
+                )
         except Exception as e:
             click.echo(f"ERROR: Failed to load model: {e}")
             if model == "florence":
@@ -180,42 +273,49 @@ def main(
     
     # Step 4: Generate captions
     click.echo("\n[4/4] Generating captions...")
-    lora_type_enum = LoRAType(lora_type.lower())
     
     captions_generated = 0
     errors = []
     
     # Use tqdm for progress
-    for image_path in tqdm(images, desc="Captioning", unit="img"):
+    with tqdm(total=len(to_caption), desc="Captioning", unit="img") as progress:
         if dry_run:
-            caption = f"[DRY RUN] Caption for {image_path.name}"
-            if trigger_word:
-                caption = f"{trigger_word}, {caption}"
-        else:
-            try:
-                caption = caption_image(
-                    image_path=image_path,
-                    model=loaded_model,
-                    processor=processor,
-                    device=device_str,
-                    lora_type=lora_type_enum,
-                    trigger_word=trigger_word,
-                    model_type=model,
-                )
-            except Exception as e:
-                errors.append((image_path, str(e)))
-                continue
-        
-        # Write caption file
-        caption_path = image_path.with_suffix(".txt")
-        if dry_run:
-            pass  # Don't write in dry run
-        else:
-            try:
-                caption_path.write_text(caption, encoding="utf-8")
-                captions_generated += 1
-            except Exception as e:
-                errors.append((image_path, f"Write error: {e}"))
+            progress.update(len(to_caption))  # Nothing to caption in dry run
+        elif to_caption:
+            results = iter_captions(
+                to_caption,
+                model=loaded_model,
+                processor=processor,
+                device=device_str,
+                lora_type=lora_type_enum,
+                model_type=model,
+                batch_size=batch_size,
+                num_beams=beam_size,
+                max_new_tokens=max_new_tokens,
+            )
+            
+            # Caption files are written on a background thread so disk I/O
+            # overlaps with captioning the next batch
+            pending_writes = []
+            with ThreadPoolExecutor(max_workers=1) as writer:
+                for image_path, caption in results:
+                    progress.update(1)
+                    
+                    if isinstance(caption, Exception):
+                        errors.append((image_path, str(caption)))
+                        continue
+                    
+                    future = writer.submit(
+                        write_caption_file, image_path, caption, trigger_word=trigger_word
+                    )
+                    pending_writes.append((image_path, future))
+            
+            for image_path, future in pending_writes:
+                try:
+                    future.result()
+                    captions_generated += 1
+                except Exception as e:
+                    errors.append((image_path, f"Write error: {e}"))
     
     # Step 5: Summary
     click.echo(f"\n{'='*50}")
@@ -223,6 +323,8 @@ def main(
     click.echo(f"{'='*50}")
     click.echo(f"   Images processed: {len(images)}")
     click.echo(f"   Captions created: {captions_generated if not dry_run else '(dry run)'}")
+    if len(to_caption) < len(images):
+        click.echo(f"   Already captioned: {len(images) - len(to_caption)} (skipped)")
     
     if errors:
         click.echo(f"\nWARNING: Errors ({len(errors)}):")
@@ -235,6 +337,8 @@ def main(
         click.echo(f"\nDONE! Captions saved to: {output_path}")
     elif dry_run:
         click.echo("\nDry run complete. No files were modified.")
+    elif not to_caption:
+        click.echo("\nDONE! All images already have captions.")
 
 
 if __name__ == "__main__":
@@ -1,14 +1,107 @@
 """
 Image file discovery and processing for LoRA Captioner.
 
-Handles finding images, renaming them, and writing caption files.
+Handles finding images, decoding them, renaming them, and writing caption files.
 """
 
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from pathlib import Path
 from typing import Iterator
 
+from PIL import Image
+
 # Supported image formats
-SUPPORTED_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp", ".bmp", ".gif", ".tiff", ".tif"}
+SUPPORTED_EXTENSIONS = frozenset({
+    ".jpg", ".jpeg", ".png", ".webp", ".bmp", ".gif", ".tiff", ".tif",
+})
+
+# Same extensions as a tuple, for a single str.endswith() check per file name
+_SUPPORTED_EXT_TUPLE = tuple(SUPPORTED_EXTENSIONS)
+
+# Concurrent renames; helps most on network shares and other high-latency storage
+RENAME_WORKERS = 8
+
+# Formats decoded with libjpeg-turbo when PyTurboJPEG is installed
+JPEG_EXTENSIONS = {".jpg", ".jpeg"}
+
+
+@lru_cache(maxsize=1)
+def _get_turbojpeg():
+    """Get a shared TurboJPEG decoder, or None if PyTurboJPEG is unavailable."""
+    try:
+        from turbojpeg import TurboJPEG
+        
+        return TurboJPEG()
+    except (ImportError, OSError, RuntimeError):
+        # Package missing, or the libturbojpeg shared library was not found
+        return None
+
+
+def load_image(image_path: Path) -> Image.Image:
+    """
+    Open and fully decode an image as RGB.
+    
+    JPEGs are decoded with libjpeg-turbo's SIMD decoder when the optional
+    PyTurboJPEG package is installed; everything else (and any JPEG it
+    rejects, such as CMYK files) goes through Pillow.
+    
+    Args:
+        image_path: Path to the image file
+        
+    Returns:
+        Decoded RGB image
+    """
+    if image_path.suffix.lower() in JPEG_EXTENSIONS:
+        jpeg = _get_turbojpeg()
+        if jpeg is not None:
+            from turbojpeg import TJPF_RGB
+            
+            try:
+                pixels = jpeg.decode(image_path.read_bytes(), pixel_format=TJPF_RGB)
+                return Image.fromarray(pixels)
+            except OSError:
+                pass  # Fall back to Pillow
+    
+    return Image.open(image_path).convert("RGB")
+
+
+def iter_images(input_dir: Path, recursive: bool = False) -> Iterator[Path]:
+    """
+    Lazily yield supported image files in a directory, in no particular order.
+    
+    Uses os.scandir: DirEntry carries the file type from the directory
+    listing, so entries are filtered by name before any stat call and Path
+    objects are only built for matches. Recursive scans skip hidden
+    directories (.git, .cache, ...) and do not follow directory symlinks.
+    
+    Args:
+        input_dir: Directory to search
+        recursive: Whether to search subdirectories
+        
+    Yields:
+        Image file paths
+    """
+    pending = [os.fspath(input_dir)]
+    while pending:
+        with os.scandir(pending.pop()) as entries:
+            for entry in entries:
+                name = entry.name
+                lower = name.lower()
+                # A bare ".jpg" is a dotfile without an extension, as Path.suffix sees it
+                if (
+                    lower.endswith(_SUPPORTED_EXT_TUPLE)
+                    and lower not in SUPPORTED_EXTENSIONS
+                    and entry.is_file()
+                ):
+                    yield Path(entry.path)
+                elif (
+                    recursive
+                    and not name.startswith(".")
+                    and entry.is_dir(follow_symlinks=False)
+                ):
+                    pending.append(entry.path)
 
 
 def discover_images(
@@ -25,15 +118,7 @@ def discover_images(
     Returns:
         Sorted list of image file paths
     """
-    if recursive:
-        pattern = "**/*"
-    else:
-        pattern = "*"
-    
-    images = []
-    for path in input_dir.glob(pattern):
-        if path.is_file() and path.suffix.lower() in SUPPORTED_EXTENSIONS:
-            images.append(path)
+    images = list(iter_images(input_dir, recursive))
     
     # Sort for consistent ordering
     images.sort(key=lambda p: p.name.lower())
@@ -41,6 +126,19 @@ def discover_images(
     return images
 
 
+def find_uncaptioned_images(image_paths: list[Path]) -> list[Path]:
+    """
+    Filter out images that already have a caption file next to them.
+    
+    Args:
+        image_paths: Image file paths
+        
+    Returns:
+        Image paths without an existing .txt caption, in the same order
+    """
+    return [path for path in image_paths if not path.with_suffix(".txt").exists()]
+
+
 def generate_new_names(
     image_paths: list[Path],
     dataset_name: str,
@@ -80,6 +178,15 @@ def rename_images(
     """
     Rename images according to the mappings.
     
+    Renames are independent syscalls, so they run on a thread pool unless a
+    target is another image's current name: then order matters (and a
+    concurrent rename could overwrite a file) and they run one by one.
+    
+    Each image's .txt caption moves with it, so a rerun after images were
+    added or removed never pairs an image with another image's caption.
+    A caption already at the new name that no image brings along is stale
+    and gets replaced.
+    
     Args:
         mappings: List of (original_path, new_path) tuples
         dry_run: If True, don't actually rename files
@@ -87,27 +194,82 @@ def rename_images(
     Returns:
         List of new file paths
     """
-    new_paths = []
+    new_paths = [new for _, new in mappings]
     
-    for original, new in mappings:
-        if dry_run:
+    if dry_run:
+        for original, new in mappings:
             print(f"Would rename: {original.name} -> {new.name}")
-        else:
+        return new_paths
+    
+    sources = {original for original, _ in mappings}
+    if any(new != original and new in sources for original, new in mappings):
+        captions = _read_moving_captions(mappings)
+        for original, new in mappings:
             # Handle case where new path might already exist
             if new.exists() and new != original:
                 raise FileExistsError(f"Target file already exists: {new}")
             
             original.rename(new)
         
-        new_paths.append(new)
+        _move_captions(captions, mappings)
+        return new_paths
+    
+    # Check every target up front so a conflict fails before anything moves
+    for original, new in mappings:
+        if new != original and new.exists():
+            raise FileExistsError(f"Target file already exists: {new}")
     
+    captions = _read_moving_captions(mappings)
+    with ThreadPoolExecutor(max_workers=RENAME_WORKERS) as pool:
+        # Consume the results so any rename error is raised here
+        for _ in pool.map(lambda mapping: mapping[0].rename(mapping[1]), mappings):
+            pass
+    
+    _move_captions(captions, mappings)
     return new_paths
 
 
+def _read_moving_captions(mappings: list[tuple[Path, Path]]) -> dict[Path, tuple[Path, bytes]]:
+    """
+    Read the caption of every image that is about to move.
+    
+    Captions are small, and holding them in memory means an old caption
+    name that is also another image's new caption name cannot be
+    overwritten before it has been read.
+    
+    Returns:
+        Mapping of new caption path to (old caption path, caption bytes)
+    """
+    captions = {}
+    for original, new in mappings:
+        caption_path = original.with_suffix(".txt")
+        if new != original and caption_path.is_file():
+            captions[new.with_suffix(".txt")] = (caption_path, caption_path.read_bytes())
+    return captions
+
+
+def _move_captions(
+    captions: dict[Path, tuple[Path, bytes]],
+    mappings: list[tuple[Path, Path]],
+) -> None:
+    """Write captions read by _read_moving_captions at their new names and remove the old files."""
+    # Old names that are still in use, by a moved caption or an image that stays put
+    kept = captions.keys() | {
+        original.with_suffix(".txt") for original, new in mappings if new == original
+    }
+    for old_path, _ in captions.values():
+        if old_path not in kept:
+            old_path.unlink(missing_ok=True)
+    
+    for new_path, (_, data) in captions.items():
+        new_path.write_bytes(data)
+
+
 def write_caption_file(
     image_path: Path,
     caption: str,
     dry_run: bool = False,
+    trigger_word: str | None = None,
 ) -> Path:
     """
     Write a caption file for an image.
@@ -118,12 +280,17 @@ def write_caption_file(
         image_path: Path to the image file
         caption: Caption text to write
         dry_run: If True, don't actually write file
+        trigger_word: Optional trigger word to prepend
         
     Returns:
         Path to the caption file
     """
     caption_path = image_path.with_suffix(".txt")
     
+    # Prepend trigger word if specified
+    if trigger_word:
+        caption = f"{trigger_word}, {caption}"
+    
     if dry_run:
         print(f"Would write caption to: {caption_path.name}")
         print(f"  Caption: {caption[:100]}{'...' if len(caption) > 100 else ''}")
@@ -136,6 +303,7 @@ def write_caption_file(
 def write_all_captions(
     captions: list[tuple[Path, str]],
     dry_run: bool = False,
+    trigger_word: str | None = None,
 ) -> list[Path]:
     """
     Write caption files for all images.
@@ -143,6 +311,7 @@ def write_all_captions(
     Args:
         captions: List of (image_path, caption) tuples
         dry_run: If True, don't actually write files
+        trigger_word: Optional trigger word to prepend
         
     Returns:
         List of caption file paths
@@ -150,7 +319,7 @@ def write_all_captions(
     caption_paths = []
     
     for image_path, caption in captions:
-        caption_path = write_caption_file(image_path, caption, dry_run)
+        caption_path = write_caption_file(image_path, caption, dry_run, trigger_word)
         caption_paths.append(caption_path)
     
     return caption_paths
@@ -178,10 +347,9 @@ def create_rename_log(
         print(f"Would write rename log to: {log_path}")
         return None
     
-    lines = ["# Original Name -> New Name\n"]
-    for original, new in mappings:
-        lines.append(f"{original.name} -> {new.name}\n")
+    header = "# Original Name -> New Name\n"
+    body = "".join(f"{original.name} -> {new.name}\n" for original, new in mappings)
     
-    log_path.write_text("".join(lines), encoding="utf-8")
+    log_path.write_text(header + body, encoding="utf-8")
     
     return log_path
@@ -6,12 +6,17 @@ Supports multiple vision-language models:
 - Florence-2: Better for LoRA training, requires transformers<=4.51.3
 """
 
+import importlib.util
 import os
+from functools import lru_cache
 from pathlib import Path
 from typing import Literal
 
 import torch
 
+# Allow TF32 tensor cores for any fp32 matmuls left after loading in half precision
+torch.set_float32_matmul_precision("high")
+
 # Model configurations
 MODELS = {
     "blip": {
@@ -24,17 +29,55 @@ MODELS = {
     },
 }
 
+# Submodules compiled by --compile. generate() calls these through
+# module(...), so they are compiled in place rather than wrapped.
+COMPILE_TARGETS = {
+    "blip": ("vision_model", "text_decoder"),
+    "florence": ("vision_tower", "language_model"),
+}
+
+# Convolutional vision encoder of each model
+VISION_ATTRS = {
+    "blip": "vision_model",
+    "florence": "vision_tower",
+}
+
+# Set to "1" to have load_model compile the model on CUDA by default
+COMPILE_ENV_VAR = "LORA_CAPTIONER_COMPILE"
+
+# Set to "1" to run BLIP's vision encoder as a TorchScript trace
+JIT_ENV_VAR = "LORA_CAPTIONER_JIT"
+
+# Files is_model_cached requires, plus at least one of WEIGHT_FILES
+REQUIRED_MODEL_FILES = ("config.json", "preprocessor_config.json")
+WEIGHT_FILES = (
+    "model.safetensors",
+    "pytorch_model.bin",
+    "model.safetensors.index.json",
+    "pytorch_model.bin.index.json",
+)
+
 # Cache directory for models
 DEFAULT_CACHE_DIR = Path.home() / ".cache" / "lora-captioner" / "models"
 
 
 DeviceType = Literal["auto", "cuda", "cpu"]
+QuantizationType = Literal["none", "bf16", "int8"]
+
+# Models held by load_model, keyed by (model, device, dtype, cache dir, compile,
+# quantization) and kept in least-recently-used order
+_MODEL_CACHE: dict[tuple, tuple] = {}
+_MODEL_CACHE_SIZE = 4
 
 
+@lru_cache(maxsize=4)
 def detect_device(requested: DeviceType = "auto") -> tuple[str, torch.dtype]:
     """
     Detect the best available device for inference.
     
+    The result is cached per requested device, since the hardware does not
+    change while the process runs.
+    
     Args:
         requested: User-requested device ("auto", "cuda", or "cpu")
         
@@ -49,6 +92,9 @@ def detect_device(requested: DeviceType = "auto") -> tuple[str, torch.dtype]:
             # Check VRAM availability
             vram_gb = torch.cuda.get_device_properties(0).total_memory / (1024**3)
             if vram_gb >= 2.0:  # Florence-2-PromptGen needs ~1-2GB
+                # bf16 keeps fp32's range on Ampere+; older GPUs use fp16
+                if torch.cuda.is_bf16_supported():
+                    return "cuda:0", torch.bfloat16
                 return "cuda:0", torch.float16
             else:
                 print(f"Warning: Only {vram_gb:.1f}GB VRAM available. Using CPU instead.")
@@ -59,6 +105,26 @@ def detect_device(requested: DeviceType = "auto") -> tuple[str, torch.dtype]:
     return "cpu", torch.float32
 
 
+def warmup_cuda() -> None:
+    """
+    Create the CUDA context ahead of time so the first caption does not pay for it.
+    
+    Safe to run in a background thread while images are discovered or the
+    model downloads. Also lets cuDNN benchmark and cache its fastest kernels,
+    since pixel batches keep the same shape from batch to batch.
+    """
+    if not torch.cuda.is_available():
+        return
+    
+    torch.backends.cuda.matmul.allow_tf32 = True
+    torch.backends.cudnn.allow_tf32 = True
+    torch.backends.cudnn.benchmark = True
+    
+    torch.cuda.init()
+    torch.empty(1, device="cuda")
+    torch.cuda.synchronize()
+
+
 def get_model_path(model_id: str, cache_dir: Path | None = None) -> Path:
     """
     Get the local cache path for a model.
@@ -83,6 +149,10 @@ def is_model_cached(model_id: str, cache_dir: Path | None = None) -> bool:
     """
     Check if a model is already downloaded.
     
+    Looks in the same HuggingFace cache that load_model reads from, without
+    touching the network, and requires the config, the preprocessor config
+    and a weights file, so an interrupted download does not count.
+    
     Args:
         model_id: HuggingFace model ID
         cache_dir: Custom cache directory (optional)
@@ -90,87 +160,494 @@ def is_model_cached(model_id: str, cache_dir: Path | None = None) -> bool:
     Returns:
         True if model is cached, False otherwise
     """
-    model_path = get_model_path(model_id, cache_dir)
-    return model_path.exists() and any(model_path.iterdir())
+    from huggingface_hub import try_to_load_from_cache
+    
+    def cached(filename: str) -> bool:
+        # Returns a path when cached, None or a "known missing" marker otherwise
+        path = try_to_load_from_cache(model_id, filename, cache_dir=cache_dir)
+        return isinstance(path, str)
+    
+    return all(cached(f) for f in REQUIRED_MODEL_FILES) and any(
+        cached(f) for f in WEIGHT_FILES
+    )
+
+
+def _from_pretrained(cls, model_id: str, **kwargs):
+    """
+    Load from the local HuggingFace cache, downloading only on a cache miss.
+    
+    A plain from_pretrained() asks the Hub whether every cached file is still
+    current, which costs a network round trip per file on each load.
+    """
+    try:
+        return cls.from_pretrained(model_id, local_files_only=True, **kwargs)
+    except OSError:
+        return cls.from_pretrained(model_id, **kwargs)
 
 
 def load_model(
     device: DeviceType = "auto",
     model_type: str = "blip",
     cache_dir: Path | None = None,
+    compile_model: bool | None = None,
+    quantization: QuantizationType = "none",
 ):
     """
     Load the captioning model and processor.
     
-    Downloads the model if not already cached.
+    Downloads the model if not already cached. Loaded models are kept in
+    memory, so repeated calls with the same settings return the resident
+    model instead of reading the weights again; see clear_model_cache().
     
     Args:
         device: Device to load model on ("auto", "cuda", or "cpu")
         model_type: Type of model ("blip" or "florence")
         cache_dir: Custom cache directory (optional)
+        compile_model: Compile the vision encoder and text decoder with
+            torch.compile. The first batch is slow while graphs are built;
+            later batches replay the captured CUDA graphs. None (default)
+            compiles on CUDA only when LORA_CAPTIONER_COMPILE=1 is set.
+            If torch.compile is unavailable the model runs eagerly.
+        quantization: Weight precision: "none" (device default), "bf16"
+            (also on CPUs with AVX-512 BF16), or "int8" (CUDA only, needs
+            bitsandbytes). Unsupported choices fall back to "none".
         
     Returns:
         Tuple of (model, processor, device_string)
     """
     device_str, dtype = detect_device(device)
+    model_type = model_type.lower() if model_type.lower() in MODELS else "blip"
+    quantization, dtype = _resolve_quantization(quantization, device_str, dtype)
+    
+    if compile_model is None:
+        compile_model = device_str.startswith("cuda") and os.environ.get(COMPILE_ENV_VAR) == "1"
+    if compile_model and quantization == "int8":
+        print("Warning: int8 models are not compiled. Running eagerly.")
+        compile_model = False
+    
+    key = (model_type, device_str, dtype, cache_dir, compile_model, quantization)
+    cached = _MODEL_CACHE.pop(key, None)
+    
+    # A caller may have moved the cached model (e.g. model.cpu()); reload it
+    if cached is None or not _is_on_device(cached[0], device_str):
+        cached = _load_and_prepare(*key)
+    
+    # Re-insert at the end so the dict stays in least-recently-used order
+    _MODEL_CACHE[key] = cached
+    while len(_MODEL_CACHE) > _MODEL_CACHE_SIZE:
+        del _MODEL_CACHE[next(iter(_MODEL_CACHE))]
+    
+    model, processor = cached
+    return model, processor, device_str
+
+
+def _is_on_device(model, device_str: str) -> bool:
+    """Check that a model's weights are still on the device it was loaded for."""
+    target = torch.device(device_str)
+    actual = next(model.parameters()).device
+    # "cuda" means the current GPU, so only compare indexes when one was given
+    return actual.type == target.type and target.index in (None, actual.index)
+
+
+def load_shared_model(
+    device: DeviceType = "auto",
+    model_type: str = "blip",
+    cache_dir: Path | None = None,
+    quantization: QuantizationType = "none",
+):
+    """
+    Load a model that worker processes can use without their own copy of the weights.
+    
+    On CPU the weights are moved into shared memory, so passing the model
+    to processes started with torch.multiprocessing hands over a handle
+    instead of pickling ~1 GB per worker. This switches torch.multiprocessing
+    to the "file_system" sharing strategy, which avoids running out of file
+    descriptors with many tensors.
+    
+    On CUDA nothing extra is done: a GPU model should be driven from a single
+    process (one CUDA context), with other processes sending it work rather
+    than loading the model themselves.
+    
+    The model is never compiled, since compiled modules cannot be sent to
+    other processes.
+    
+    Args:
+        device: Device to load model on ("auto", "cuda", or "cpu")
+        model_type: Type of model ("blip" or "florence")
+        cache_dir: Custom cache directory (optional)
+        quantization: Weight precision, as for load_model
+        
+    Returns:
+        Tuple of (model, processor, device_string)
+    """
+    model, processor, device_str = load_model(
+        device=device,
+        model_type=model_type,
+        cache_dir=cache_dir,
+        compile_model=False,
+        quantization=quantization,
+    )
+    
+    if device_str == "cpu":
+        import torch.multiprocessing as mp
+        
+        mp.set_sharing_strategy("file_system")
+        model.share_memory()
+    
+    return model, processor, device_str
+
+
+def _load_and_prepare(
+    model_type: str,
+    device_str: str,
+    dtype: torch.dtype,
+    cache_dir: Path | None,
+    compile_model: bool,
+    quantization: QuantizationType,
+):
+    """
+    Load and prepare a model.
     
-    model_config = MODELS.get(model_type.lower(), MODELS["blip"])
-    model_id = model_config["model_id"]
+    Called by load_model on a cache miss, with its cache key as arguments.
+    """
+    model_id = MODELS[model_type]["model_id"]
     
     print(f"Loading model: {model_id}")
-    print(f"Device: {device_str}, dtype: {dtype}")
+    print(f"Device: {device_str}, dtype: {dtype}, quantization: {quantization}")
+    
+    load_kwargs = _load_kwargs(quantization, device_str)
     
-    if model_type.lower() == "florence":
-        return _load_florence(model_id, device_str, dtype, cache_dir)
+    if model_type == "florence":
+        model, processor, device_str = _load_florence(
+            model_id, device_str, dtype, cache_dir, **load_kwargs
+        )
     else:
-        return _load_blip(model_id, device_str, dtype, cache_dir)
+        model, processor, device_str = _load_blip(
+            model_id, device_str, dtype, cache_dir, **load_kwargs
+        )
+    
+    # Saves captioning from scanning model.parameters() on every batch
+    model._cached_dtype = dtype
+    
+    if device_str.startswith("cuda"):
+        _use_channels_last(model, model_type)
+    
+    if compile_model:
+        _compile_model(model, model_type, device_str)
+    elif model_type == "blip" and quantization != "int8" and os.environ.get(JIT_ENV_VAR) == "1":
+        _use_traced_vision(model, model_id, device_str, dtype, cache_dir)
+    
+    if device_str.startswith("cuda"):
+        # Hand blocks left over from weight conversion back to the driver.
+        # The first batch pays one cudaMalloc, but the freed VRAM stays
+        # available for larger batches
+        torch.cuda.synchronize()
+        torch.cuda.empty_cache()
+    
+    return model, processor
 
 
-def _load_blip(model_id: str, device_str: str, dtype: torch.dtype, cache_dir: Path | None):
-    """Load BLIP model."""
+def _resolve_quantization(
+    quantization: QuantizationType,
+    device_str: str,
+    dtype: torch.dtype,
+) -> tuple[QuantizationType, torch.dtype]:
+    """
+    Check a quantization choice against the device.
+    
+    Returns:
+        Tuple of (effective quantization, dtype for weights and inputs)
+    """
+    if quantization == "bf16":
+        if device_str.startswith("cuda"):
+            # detect_device already picks bf16 on GPUs that support it
+            if dtype is torch.bfloat16:
+                return "bf16", dtype
+            print(f"Warning: This GPU lacks bf16 support. Using {dtype}.")
+            return "none", dtype
+        if getattr(torch.cpu, "_is_avx512_bf16_supported", lambda: False)():
+            return "bf16", torch.bfloat16
+        print("Warning: This CPU lacks AVX-512 BF16 support. Using float32.")
+        return "none", dtype
+    
+    if quantization == "int8":
+        if not device_str.startswith("cuda"):
+            print("Warning: int8 quantization needs a CUDA GPU. Using float32.")
+            return "none", dtype
+        if importlib.util.find_spec("bitsandbytes") is None:
+            print(
+                "Warning: int8 quantization needs bitsandbytes "
+                "(pip install lora-captioner[int8]). Using the default dtype."
+            )
+            return "none", dtype
+        # Layers bitsandbytes leaves unquantized run in fp16, as its kernels expect
+        return "int8", torch.float16
+    
+    return "none", dtype
+
+
+def _load_kwargs(quantization: QuantizationType, device_str: str) -> dict:
+    """
+    Extra from_pretrained() arguments for the device and quantization choice.
+    
+    With accelerate installed, weights are loaded straight onto the target
+    device without first materialising a randomly initialised copy in host
+    RAM, instead of loading on the CPU and copying the whole model over with
+    .to(). Loaders skip .to() whenever device_map is set.
+    """
+    kwargs = {}
+    
+    if importlib.util.find_spec("accelerate") is not None:
+        kwargs["low_cpu_mem_usage"] = True
+        if device_str.startswith("cuda"):
+            kwargs["device_map"] = {"": device_str}
+    
+    if quantization == "int8":
+        from transformers import BitsAndBytesConfig
+        
+        # bitsandbytes places the weights itself; quantized models cannot be .to()'d
+        kwargs["quantization_config"] = BitsAndBytesConfig(load_in_8bit=True)
+        kwargs["device_map"] = {"": device_str}
+    
+    return kwargs
+
+
+def clear_model_cache() -> None:
+    """Drop all models held by load_model and release their GPU memory."""
+    _MODEL_CACHE.clear()
+    
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
+
+
+def _use_channels_last(model, model_type: str) -> None:
+    """
+    Store the vision encoder's conv weights in channels_last (NHWC) layout.
+    
+    cuDNN picks faster tensor-core kernels for NHWC convolutions on Ampere and
+    newer GPUs. The text decoder has no convolutions and is left as is.
+    """
+    vision = getattr(model, VISION_ATTRS.get(model_type, VISION_ATTRS["blip"]), None)
+    if vision is not None:
+        vision.to(memory_format=torch.channels_last)
+
+
+def _compile_model(model, model_type: str, device_str: str) -> None:
+    """
+    Compile the model's vision encoder and text decoder in place.
+    
+    Uses mode="reduce-overhead" on CUDA so decode steps replay CUDA graphs
+    instead of relaunching every kernel from Python.
+    """
+    if not hasattr(torch.nn.Module, "compile"):
+        print("Warning: torch.compile needs torch>=2.2. Running eagerly.")
+        return
+    
+    mode = "reduce-overhead" if device_str.startswith("cuda") else "default"
+    
+    try:
+        for name in COMPILE_TARGETS.get(model_type, COMPILE_TARGETS["blip"]):
+            getattr(model, name).compile(mode=mode)
+        
+        # Florence-2 encodes images via forward_features_unpool, not forward
+        vision_tower = getattr(model, "vision_tower", None)
+        if hasattr(vision_tower, "forward_features_unpool"):
+            vision_tower.forward_features_unpool = torch.compile(
+                vision_tower.forward_features_unpool, mode=mode
+            )
+    except Exception as e:
+        # Some torch builds refuse up front (e.g. Dynamo on an unsupported Python)
+        print(f"Warning: torch.compile is unavailable ({e}). Running eagerly.")
+        uncompile_model(model)
+        return
+    
+    # Tells the captioner to keep batch shapes fixed so graphs are reused
+    model._is_compiled = True
+
+
+def uncompile_model(model) -> None:
+    """
+    Undo compilation so the model runs eagerly again.
+    
+    torch.compile builds its graphs on the first call, so a missing backend
+    (no triton on Windows, GPUs older than Volta) only fails then.
+    warmup_model calls this to fall back instead of failing the run.
+    
+    Args:
+        model: Model prepared by load_model with compile_model=True
+    """
+    for names in COMPILE_TARGETS.values():
+        for name in names:
+            module = getattr(model, name, None)
+            if isinstance(module, torch.nn.Module):
+                module._compiled_call_impl = None
+    
+    # Drop the compiled instance attribute so the class method is used again
+    vision_tower = getattr(model, "vision_tower", None)
+    if vision_tower is not None:
+        vision_tower.__dict__.pop("forward_features_unpool", None)
+    
+    model._is_compiled = False
+
+
+class _VisionTrace(torch.nn.Module):
+    """Returns only the encoder's last hidden state, which torch.jit.trace can record."""
+    
+    def __init__(self, vision_model):
+        super().__init__()
+        self.vision_model = vision_model
+    
+    def forward(self, pixel_values):
+        return self.vision_model(pixel_values=pixel_values, return_dict=False)[0]
+
+
+class _TracedVision(torch.nn.Module):
+    """Stands in for BLIP's vision_model inside generate(), which only reads output[0]."""
+    
+    def __init__(self, traced):
+        super().__init__()
+        self.traced = traced
+    
+    def forward(self, pixel_values, **kwargs):
+        return (self.traced(pixel_values),)
+
+
+def _use_traced_vision(
+    model,
+    model_id: str,
+    device_str: str,
+    dtype: torch.dtype,
+    cache_dir: Path | None,
+) -> None:
+    """
+    Swap BLIP's vision encoder for a TorchScript trace saved in the model's snapshot.
+    
+    The first run traces the encoder and saves it; later runs load the saved
+    trace and skip building the module graph. Only the encoder is traced, since
+    generate()'s decode loop has data-dependent control flow that a trace would
+    freeze.
+    """
+    ts_path = _traced_vision_path(model_id, device_str, dtype, cache_dir)
+    
+    if ts_path is not None and ts_path.exists():
+        traced = torch.jit.load(str(ts_path), map_location=device_str)
+    else:
+        size = model.config.vision_config.image_size
+        dummy = torch.zeros(1, 3, size, size, dtype=dtype, device=device_str)
+        try:
+            with torch.inference_mode():
+                traced = torch.jit.trace(_VisionTrace(model.vision_model), (dummy,), strict=False)
+        except Exception as e:
+            print(f"Warning: Could not trace vision encoder ({e}). Running eagerly.")
+            return
+        if ts_path is not None:
+            torch.jit.save(traced, str(ts_path))
+    
+    model.vision_model = _TracedVision(traced)
+
+
+def _traced_vision_path(
+    model_id: str,
+    device_str: str,
+    dtype: torch.dtype,
+    cache_dir: Path | None,
+) -> Path | None:
+    """
+    Get where the vision encoder trace for these weights and settings is saved.
+    
+    The file sits in the HuggingFace snapshot directory the weights were loaded
+    from, so updated weights (a new snapshot) never pick up an old trace. The
+    torch and transformers versions in the name do the same for library
+    upgrades.
+    
+    Returns:
+        Path to the .pt file, or None if the model is not in the HuggingFace cache
+    """
+    import transformers
+    from huggingface_hub import try_to_load_from_cache
+    
+    config_path = try_to_load_from_cache(model_id, "config.json", cache_dir=cache_dir)
+    if not isinstance(config_path, str):
+        return None
+    
+    dtype_name = str(dtype).removeprefix("torch.")
+    return Path(config_path).parent / (
+        f"traced_vision_{device_str.replace(':', '_')}_{dtype_name}"
+        f"_torch{torch.__version__}_transformers{transformers.__version__}.pt"
+    )
+
+
+def _load_blip(
+    model_id: str,
+    device_str: str,
+    dtype: torch.dtype,
+    cache_dir: Path | None,
+    **load_kwargs,
+):
+    """Load BLIP model. load_kwargs are passed on to from_pretrained()."""
     from transformers import BlipProcessor, BlipForConditionalGeneration
     
-    processor = BlipProcessor.from_pretrained(
+    processor = _from_pretrained(
+        BlipProcessor,
         model_id,
         cache_dir=cache_dir,
     )
     
-    model = BlipForConditionalGeneration.from_pretrained(
+    model = _from_pretrained(
+        BlipForConditionalGeneration,
         model_id,
         torch_dtype=dtype,
         cache_dir=cache_dir,
-    ).to(device_str)
+        **load_kwargs,
+    )
+    if "device_map" not in load_kwargs:
+        model = model.to(device_str)
     
     model.eval()
+    # Inference only; no autograd state is kept for the weights
+    model.requires_grad_(False)
     return model, processor, device_str
 
 
-def _load_florence(model_id: str, device_str: str, dtype: torch.dtype, cache_dir: Path | None):
+def _load_florence(
+    model_id: str,
+    device_str: str,
+    dtype: torch.dtype,
+    cache_dir: Path | None,
+    **load_kwargs,
+):
     """
-    Load Florence-2 model.
+    Load Florence-2 model. load_kwargs are passed on to from_pretrained().
     
     Note: Requires transformers<=4.51.3 for compatibility.
     """
     from transformers import AutoModelForCausalLM, AutoProcessor, AutoConfig
     
     # Load config first and set attention implementation to avoid SDPA issues
-    config = AutoConfig.from_pretrained(model_id, trust_remote_code=True)
+    config = _from_pretrained(AutoConfig, model_id, trust_remote_code=True, cache_dir=cache_dir)
     config._attn_implementation = "eager"
     
-    processor = AutoProcessor.from_pretrained(
+    processor = _from_pretrained(
+        AutoProcessor,
         model_id,
         trust_remote_code=True,
         cache_dir=cache_dir,
     )
     
-    model = AutoModelForCausalLM.from_pretrained(
+    model = _from_pretrained(
+        AutoModelForCausalLM,
         model_id,
         config=config,
         trust_remote_code=True,
         torch_dtype=dtype,
         cache_dir=cache_dir,
         attn_implementation="eager",
-    ).to(device_str)
+        **load_kwargs,
+    )
+    if "device_map" not in load_kwargs:
+        model = model.to(device_str)
     
     model.eval()
+    # Inference only; no autograd state is kept for the weights
+    model.requires_grad_(False)
     return model, processor, device_str
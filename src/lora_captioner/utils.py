@@ -2,68 +2,110 @@
 Utility functions for LoRA Captioner.
 """
 
+import os
 import sys
+import time
+from functools import lru_cache
 from pathlib import Path
 
 
+# How long live VRAM stats are reused, so polling callers coalesce driver queries
+VRAM_INFO_TTL_S = 0.25
+
+# (timestamp, info) of the last live VRAM query
+_vram_cache: tuple[float, dict] | None = None
+
+
+@lru_cache(maxsize=1)
+def _static_gpu_info() -> tuple[int, str, int] | None:
+    """Get (device index, name, total bytes) of the current GPU, or None without CUDA."""
+    import torch
+    
+    if not torch.cuda.is_available():
+        return None
+    
+    device = torch.cuda.current_device()
+    props = torch.cuda.get_device_properties(device)
+    return device, props.name, props.total_memory
+
+
 def get_vram_info() -> dict | None:
     """
     Get information about available GPU VRAM.
     
+    The device name and total memory are looked up once; usage figures are
+    re-queried at most every VRAM_INFO_TTL_S seconds.
+    
     Returns:
         Dict with VRAM info, or None if no GPU available
     """
+    global _vram_cache
+    
     try:
         import torch
         
-        if not torch.cuda.is_available():
+        static_info = _static_gpu_info()
+        if static_info is None:
             return None
         
-        device = torch.cuda.current_device()
-        props = torch.cuda.get_device_properties(device)
+        now = time.monotonic()
+        if _vram_cache is not None and now - _vram_cache[0] < VRAM_INFO_TTL_S:
+            return dict(_vram_cache[1])
         
-        total_vram = props.total_memory / (1024**3)  # GB
+        device, name, total_memory = static_info
+        
+        total_vram = total_memory / (1024**3)  # GB
         allocated = torch.cuda.memory_allocated(device) / (1024**3)
         reserved = torch.cuda.memory_reserved(device) / (1024**3)
         free = total_vram - reserved
         
-        return {
-            "device_name": props.name,
+        info = {
+            "device_name": name,
             "total_gb": round(total_vram, 2),
             "allocated_gb": round(allocated, 2),
             "reserved_gb": round(reserved, 2),
             "free_gb": round(free, 2),
         }
+        _vram_cache = (now, info)
+        return dict(info)
     except Exception:
         return None
 
 
-def get_system_info() -> dict:
-    """
-    Get basic system information.
-    
-    Returns:
-        Dict with system info
-    """
+@lru_cache(maxsize=1)
+def _static_system_info() -> dict:
+    """Get the parts of get_system_info that cannot change while the process runs."""
     import platform
     
-    info = {
+    return {
         "python_version": sys.version,
         "platform": platform.system(),
         "platform_release": platform.release(),
         "architecture": platform.machine(),
     }
+
+
+def get_system_info() -> dict:
+    """
+    Get basic system information.
+    
+    Platform details are looked up once; only the GPU stats are refreshed.
     
-    # Add GPU info if available
-    vram_info = get_vram_info()
-    if vram_info:
-        info["gpu"] = vram_info
-    else:
-        info["gpu"] = None
+    Returns:
+        Dict with system info
+    """
+    info = dict(_static_system_info())
+    
+    # Add GPU info if available (None otherwise)
+    info["gpu"] = get_vram_info()
     
     return info
 
 
+# Units of format_file_size, each 2**10 times the previous
+_UNITS = ("B", "KB", "MB", "GB", "TB", "PB")
+
+
 def format_file_size(size_bytes: int) -> str:
     """
     Format a file size in bytes to a human-readable string.
@@ -74,27 +116,38 @@ def format_file_size(size_bytes: int) -> str:
     Returns:
         Formatted string (e.g., "1.5 MB")
     """
-    for unit in ["B", "KB", "MB", "GB", "TB"]:
-        if size_bytes < 1024:
-            return f"{size_bytes:.1f} {unit}"
-        size_bytes /= 1024
-    return f"{size_bytes:.1f} PB"
+    if size_bytes < 1024:
+        return f"{size_bytes:.1f} B"
+    
+    # Every 10 bits of magnitude is one unit step
+    index = min((int(size_bytes).bit_length() - 1) // 10, len(_UNITS) - 1)
+    return f"{size_bytes / (1 << (10 * index)):.1f} {_UNITS[index]}"
 
 
-def count_images(directory: Path) -> int:
+def count_images(directory: Path, cap: int | None = None) -> int:
     """
     Count the number of supported image files in a directory.
     
     Args:
         directory: Directory to count images in
+        cap: Stop scanning once this many images are found (optional), for
+            "N+ images" style checks on large directories
         
     Returns:
-        Number of images found
+        Number of images found, at most cap
     """
     from lora_captioner.image_processor import SUPPORTED_EXTENSIONS
     
+    if cap is not None and cap <= 0:
+        return 0
+    
+    # DirEntry.is_file() uses the file type from the directory listing, so
+    # only symlinks cost a stat call
     count = 0
-    for path in directory.iterdir():
-        if path.is_file() and path.suffix.lower() in SUPPORTED_EXTENSIONS:
-            count += 1
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if os.path.splitext(entry.name)[1].lower() in SUPPORTED_EXTENSIONS and entry.is_file():
+                count += 1
+                if count == cap:
+                    break
     return count
@@ -0,0 +1,218 @@
+"""
+Tests for captioning functionality.
+"""
+
+import numpy as np
+import pytest
+import torch
+from PIL import Image, ImageDraw
+from transformers import (
+    BertTokenizerFast,
+    BlipConfig,
+    BlipForConditionalGeneration,
+    BlipImageProcessor,
+    BlipProcessor,
+)
+
+from lora_captioner import captioner
+from lora_captioner.captioner import (
+    LoRAType,
+    _PixelStager,
+    caption_images,
+    caption_pil_image,
+    iter_captions,
+    warmup_model,
+)
+
+
+@pytest.fixture(scope="module")
+def tiny_blip(tmp_path_factory):
+    """A tiny randomly initialised BLIP model and processor that run in milliseconds on CPU."""
+    vocab = tmp_path_factory.mktemp("blip") / "vocab.txt"
+    words = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]", "[DEC]", "a", "photo", "of", "an",
+             "image", "picture", "showing"] + [f"w{i}" for i in range(50)]
+    vocab.write_text("\n".join(words))
+    tokenizer = BertTokenizerFast(vocab_file=str(vocab), bos_token="[DEC]")
+    
+    torch.manual_seed(0)
+    # A wider init than the default makes captions depend visibly on the image
+    layers = {
+        "hidden_size": 32,
+        "intermediate_size": 64,
+        "num_hidden_layers": 1,
+        "num_attention_heads": 2,
+        "initializer_range": 0.2,
+    }
+    config = BlipConfig(
+        vision_config=dict(image_size=32, patch_size=8, **layers),
+        text_config=dict(
+            vocab_size=len(tokenizer),
+            encoder_hidden_size=32,
+            bos_token_id=tokenizer.bos_token_id,
+            sep_token_id=tokenizer.sep_token_id,
+            pad_token_id=tokenizer.pad_token_id,
+            **layers,
+        ),
+    )
+    model = BlipForConditionalGeneration(config).eval()
+    processor = BlipProcessor(BlipImageProcessor(size={"height": 32, "width": 32}), tokenizer)
+    return model, processor
+
+
+def _shapes_image(width: int, height: int) -> Image.Image:
+    """Draw hard-edged shapes, where resize overshoot is largest."""
+    image = Image.new("RGB", (width, height), "white")
+    draw = ImageDraw.Draw(image)
+    draw.rectangle([width // 4, height // 4, width // 2, height // 2], fill="red")
+    draw.line([0, 0, width, height], fill="black", width=3)
+    draw.ellipse([width // 2, height // 3, width - 5, height - 5], outline="blue", width=2)
+    return image
+
+
+def _noise_image(width: int, height: int) -> Image.Image:
+    """Make an image of random pixels."""
+    rng = np.random.default_rng(width * height)
+    return Image.fromarray(rng.integers(0, 256, (height, width, 3), dtype=np.uint8))
+
+
+@pytest.mark.parametrize("make_image", [_shapes_image, _noise_image])
+@pytest.mark.parametrize("size", [(256, 256), (300, 200), (40, 90), (1024, 768)])
+def test_device_preprocess_matches_processor(make_image, size):
+    """Test that on-device resizing stays within 2 pixel levels of the processor."""
+    processor = BlipImageProcessor()
+    image = make_image(*size)
+    
+    stager = _PixelStager(processor, "cpu", torch.float32, device_preprocess=True)
+    pixel_values = stager([image, image.convert("L")])
+    expected = processor([image, image.convert("L")], return_tensors="pt")["pixel_values"]
+    
+    # Undo normalization to compare in whole 0-255 pixel levels
+    std = torch.tensor(processor.image_std).view(1, 3, 1, 1)
+    levels = ((pixel_values - expected).abs() * std * 255).round()
+    
+    assert pixel_values.shape == expected.shape
+    assert levels.max().item() <= 2.0
+    assert levels.mean().item() < 0.05
+
+
+def test_device_preprocess_is_opt_in():
+    """Test that the processor's own transform is used unless asked otherwise."""
+    stager = _PixelStager(BlipImageProcessor(), "cpu", torch.float32)
+    
+    assert stager._device_config is None
+
+
+def test_iter_captions_keeps_input_order(tiny_blip, tmp_path):
+    """Test that load failures are yielded in place, not ahead of their batch."""
+    model, processor = tiny_blip
+    paths = []
+    for i, name in enumerate(["0.png", "1.png", "bad.jpg", "2.png"]):
+        path = tmp_path / name
+        if name == "bad.jpg":
+            path.write_bytes(b"not an image")
+        else:
+            _noise_image(30 + i, 40).save(path)
+        paths.append(path)
+    
+    results = list(iter_captions(
+        paths, model, processor, "cpu", LoRAType.CHARACTER, batch_size=4, max_new_tokens=6
+    ))
+    
+    assert [path for path, _ in results] == paths
+    assert isinstance(results[2][1], Exception)
+    for path, caption in results[:2] + results[3:]:
+        expected = caption_pil_image(
+            Image.open(path).convert("RGB"), model, processor, "cpu", LoRAType.CHARACTER,
+            max_new_tokens=6,
+        )
+        assert caption == expected
+
+
+def _record_batch_sizes(monkeypatch) -> list[int]:
+    """Wrap the BLIP backend so each generate call's batch size is recorded."""
+    sizes = []
+    encode_fn, caption_fn = captioner.CAPTION_BACKENDS["blip"]
+    
+    def recording_caption_fn(images, *args, **kwargs):
+        sizes.append(len(images))
+        return caption_fn(images, *args, **kwargs)
+    
+    monkeypatch.setitem(captioner.CAPTION_BACKENDS, "blip", (encode_fn, recording_caption_fn))
+    return sizes
+
+
+def test_caption_images_matches_single_images(tiny_blip, monkeypatch):
+    """Test that batches are split by batch_size and match per-image captions."""
+    model, processor = tiny_blip
+    images = [_noise_image(30 + i, 40) for i in range(5)]
+    expected = [
+        caption_pil_image(image, model, processor, "cpu", LoRAType.STYLE, max_new_tokens=6)
+        for image in images
+    ]
+    sizes = _record_batch_sizes(monkeypatch)
+    
+    captions = caption_images(
+        images, model, processor, "cpu", LoRAType.STYLE, batch_size=2, max_new_tokens=6
+    )
+    
+    assert sizes == [2, 2, 1]
+    assert captions == expected
+    assert len(set(captions)) > 1
+
+
+def test_caption_images_pads_for_compiled_models(tiny_blip, monkeypatch):
+    """Test that compiled models always get full batches, with padding dropped."""
+    model, processor = tiny_blip
+    images = [_noise_image(30 + i, 40) for i in range(5)]
+    expected = caption_images(
+        images, model, processor, "cpu", LoRAType.STYLE, batch_size=2, max_new_tokens=6
+    )
+    monkeypatch.setattr(model, "_is_compiled", True, raising=False)
+    sizes = _record_batch_sizes(monkeypatch)
+    
+    captions = caption_images(
+        images, model, processor, "cpu", LoRAType.STYLE, batch_size=2, max_new_tokens=6
+    )
+    
+    assert sizes == [2, 2, 2]
+    assert captions == expected
+
+
+def test_caption_images_trigger_word(tiny_blip):
+    """Test that the trigger word is prepended to every caption."""
+    model, processor = tiny_blip
+    images = [_noise_image(30 + i, 40) for i in range(3)]
+    plain = caption_images(images, model, processor, "cpu", LoRAType.STYLE, max_new_tokens=6)
+    
+    captions = caption_images(
+        images, model, processor, "cpu", LoRAType.STYLE, trigger_word="ohwx", max_new_tokens=6
+    )
+    
+    assert captions == [f"ohwx, {caption}" for caption in plain]
+
+
+def test_caption_images_rejects_bad_batch_size(tiny_blip):
+    """Test that a batch size below 1 is rejected."""
+    model, processor = tiny_blip
+    
+    with pytest.raises(ValueError):
+        caption_images(
+            [_noise_image(30, 40)], model, processor, "cpu", LoRAType.STYLE, batch_size=0
+        )
+
+
+def test_warmup_falls_back_to_eager_when_compile_fails(tiny_blip):
+    """Test that a compiler failure during warmup leaves a working eager model."""
+    model, processor = tiny_blip
+    
+    def broken_backend(*args, **kwargs):
+        raise RuntimeError("Cannot find a working triton installation\nmore details")
+    
+    model.text_decoder._compiled_call_impl = broken_backend
+    model._is_compiled = True
+    
+    warmup_model(model, processor, "cpu", batch_size=2, max_new_tokens=4)
+    
+    assert not model._is_compiled
+    assert model.text_decoder._compiled_call_impl is None
+    assert caption_images([_noise_image(30, 40)], model, processor, "cpu", LoRAType.STYLE)
@@ -0,0 +1,46 @@
+"""
+Tests for the command-line interface.
+"""
+
+from click.testing import CliRunner
+
+from lora_captioner import cli
+
+
+def _run(input_dir, monkeypatch):
+    """Run the CLI on a folder with a fake model that captions each file by its content."""
+    captioned = []
+    
+    def fake_iter_captions(paths, **kwargs):
+        for path in paths:
+            captioned.append(path.name)
+            yield path, f"caption of {path.read_text()}"
+    
+    monkeypatch.setattr(cli, "load_model", lambda **kwargs: (object(), None, "cpu"))
+    monkeypatch.setattr(cli, "iter_captions", fake_iter_captions)
+    result = CliRunner().invoke(
+        cli.main, ["-i", str(input_dir), "-n", "dataset", "-t", "style", "--device", "cpu"]
+    )
+    assert result.exit_code == 0, result.output
+    return captioned
+
+
+def test_rerun_keeps_captions_with_their_images(tmp_path, monkeypatch):
+    """Test that renaming on a rerun moves captions with their images instead of reusing names."""
+    for name, content in [("a.jpg", "img1"), ("b.jpg", "img2"), ("c.jpg", "img3")]:
+        (tmp_path / name).write_text(content)
+    first_run = _run(tmp_path, monkeypatch)
+    assert first_run == ["dataset_0001.jpg", "dataset_0002.jpg", "dataset_0003.jpg"]
+    
+    # Drop the first image and its caption, and add a new image
+    (tmp_path / "dataset_0001.jpg").unlink()
+    (tmp_path / "dataset_0001.txt").unlink()
+    (tmp_path / "z.jpg").write_text("img4")
+    
+    assert _run(tmp_path, monkeypatch) == ["dataset_0003.jpg"]
+    for i, content in enumerate(["img2", "img3", "img4"], start=1):
+        assert (tmp_path / f"dataset_{i:04d}.jpg").read_text() == content
+        assert (tmp_path / f"dataset_{i:04d}.txt").read_text() == f"caption of {content}"
+    assert sorted(p.name for p in tmp_path.glob("*.txt")) == [
+        "dataset_0001.txt", "dataset_0002.txt", "dataset_0003.txt", "rename_log.txt",
+    ]
@@ -5,10 +5,16 @@ Tests for image processing functionality.
 import pytest
 from pathlib import Path
 
+from PIL import Image
+
 from lora_captioner.image_processor import (
     SUPPORTED_EXTENSIONS,
     discover_images,
+    find_uncaptioned_images,
     generate_new_names,
+    load_image,
+    rename_images,
+    write_caption_file,
 )
 
 
@@ -20,6 +26,55 @@ def test_supported_extensions():
     assert ".webp" in SUPPORTED_EXTENSIONS
 
 
+def test_discover_images(tmp_path):
+    """Test that only supported image files are found, sorted by name."""
+    for name in ["b.PNG", "a.jpg", "notes.txt", "a.txt", ".jpg"]:
+        (tmp_path / name).touch()
+    (tmp_path / "folder.jpg").mkdir()
+    (tmp_path / "sub").mkdir()
+    (tmp_path / "sub" / "c.webp").touch()
+    
+    images = discover_images(tmp_path)
+    
+    assert [p.name for p in images] == ["a.jpg", "b.PNG"]
+    assert images[0] == tmp_path / "a.jpg"
+
+
+def test_discover_images_recursive(tmp_path):
+    """Test that recursive discovery includes images in subdirectories."""
+    (tmp_path / "a.jpg").touch()
+    (tmp_path / "sub" / "deeper").mkdir(parents=True)
+    (tmp_path / "sub" / "deeper" / "c.webp").touch()
+    (tmp_path / "sub" / "b.tiff").touch()
+    (tmp_path / "album.jpg").mkdir()
+    (tmp_path / "album.jpg" / "d.png").touch()
+    
+    images = discover_images(tmp_path, recursive=True)
+    
+    assert [p.name for p in images] == ["a.jpg", "b.tiff", "c.webp", "d.png"]
+    assert images[2] == tmp_path / "sub" / "deeper" / "c.webp"
+
+
+def test_discover_images_recursive_skips_hidden_dirs(tmp_path):
+    """Test that recursive discovery ignores hidden directories like .cache."""
+    (tmp_path / "a.jpg").touch()
+    (tmp_path / ".cache").mkdir()
+    (tmp_path / ".cache" / "thumb.jpg").touch()
+    
+    images = discover_images(tmp_path, recursive=True)
+    
+    assert [p.name for p in images] == ["a.jpg"]
+
+
+def test_find_uncaptioned_images(tmp_path):
+    """Test that images with an existing caption file are filtered out."""
+    captioned = tmp_path / "a.jpg"
+    uncaptioned = tmp_path / "b.png"
+    (tmp_path / "a.txt").write_text("existing caption", encoding="utf-8")
+    
+    assert find_uncaptioned_images([captioned, uncaptioned]) == [uncaptioned]
+
+
 def test_generate_new_names():
     """Test filename generation."""
     paths = [
@@ -44,3 +99,81 @@ def test_generate_new_names_with_output_dir():
     mappings = generate_new_names(paths, "dataset", output_dir)
     
     assert mappings[0][1] == Path("/output/dataset_0001.jpg")
+
+
+@pytest.mark.parametrize("name", ["photo.jpg", "photo.JPEG", "graphic.png"])
+def test_load_image_returns_rgb(tmp_path, name):
+    """Test that images are decoded to RGB regardless of format."""
+    path = tmp_path / name
+    Image.new("L", (12, 8), 128).save(path, format="JPEG" if "jp" in name.lower() else "PNG")
+    
+    image = load_image(path)
+    
+    assert image.mode == "RGB"
+    assert image.size == (12, 8)
+
+
+def test_write_caption_file_with_trigger_word(tmp_path):
+    """Test that the trigger word is prepended when the caption is written."""
+    image_path = tmp_path / "dataset_0001.png"
+    
+    caption_path = write_caption_file(image_path, "a red car", trigger_word="sks")
+    
+    assert caption_path == tmp_path / "dataset_0001.txt"
+    assert caption_path.read_text(encoding="utf-8") == "sks, a red car"
+
+
+def test_rename_images(tmp_path):
+    """Test that all images are renamed to their new names."""
+    originals = [tmp_path / f"photo{i}.jpg" for i in range(20)]
+    for path in originals:
+        path.write_text(path.name)
+    mappings = generate_new_names(originals, "dataset")
+    
+    new_paths = rename_images(mappings)
+    
+    assert new_paths == [new for _, new in mappings]
+    assert all(not path.exists() for path in originals)
+    assert [p.read_text() for p in new_paths] == [p.name for p in originals]
+
+
+def test_rename_images_target_is_another_source(tmp_path):
+    """Test that renames onto another image's current name don't lose files."""
+    first = tmp_path / "dataset_0002.jpg"
+    second = tmp_path / "photo.jpg"
+    first.write_text("first")
+    second.write_text("second")
+    
+    rename_images(generate_new_names([first, second], "dataset"))
+    
+    assert (tmp_path / "dataset_0001.jpg").read_text() == "first"
+    assert (tmp_path / "dataset_0002.jpg").read_text() == "second"
+
+
+def test_rename_images_moves_captions(tmp_path):
+    """Test that each caption follows its image and a stale caption at a target is replaced."""
+    first = tmp_path / "dataset_0002.jpg"
+    second = tmp_path / "photo.png"
+    first.touch()
+    second.touch()
+    (tmp_path / "dataset_0001.txt").write_text("stale")
+    (tmp_path / "dataset_0002.txt").write_text("first")
+    (tmp_path / "photo.txt").write_text("second")
+    
+    rename_images(generate_new_names([first, second], "dataset"))
+    
+    assert (tmp_path / "dataset_0001.txt").read_text() == "first"
+    assert (tmp_path / "dataset_0002.txt").read_text() == "second"
+    assert not (tmp_path / "photo.txt").exists()
+
+
+def test_rename_images_existing_target(tmp_path):
+    """Test that an unrelated file at a target path aborts before renaming."""
+    original = tmp_path / "photo.jpg"
+    original.touch()
+    (tmp_path / "dataset_0001.jpg").touch()
+    
+    with pytest.raises(FileExistsError):
+        rename_images([(original, tmp_path / "dataset_0001.jpg")])
+    
+    assert original.exists()
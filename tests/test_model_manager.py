@@ -0,0 +1,167 @@
+"""
+Tests for model management functionality.
+"""
+
+import pytest
+import torch
+import torch.multiprocessing as mp
+import transformers
+
+from lora_captioner import model_manager
+from lora_captioner.model_manager import (
+    _compile_model,
+    _resolve_quantization,
+    _traced_vision_path,
+    is_model_cached,
+    load_model,
+    load_shared_model,
+)
+
+MODEL_ID = "org/name"
+
+
+def _fake_snapshot(cache_dir, files):
+    """Lay out a HuggingFace cache entry for MODEL_ID holding the given files."""
+    repo = cache_dir / "models--org--name"
+    snapshot = repo / "snapshots" / "abc123"
+    snapshot.mkdir(parents=True)
+    (repo / "refs").mkdir()
+    (repo / "refs" / "main").write_text("abc123")
+    for name in files:
+        (snapshot / name).write_text("{}")
+
+
+def test_is_model_cached_config_only(tmp_path):
+    """Test that a snapshot with only the config is not complete."""
+    _fake_snapshot(tmp_path, ["config.json"])
+    
+    assert not is_model_cached(MODEL_ID, cache_dir=tmp_path)
+
+
+def test_is_model_cached_config_and_weights(tmp_path):
+    """Test that a snapshot missing the preprocessor config is not complete."""
+    _fake_snapshot(tmp_path, ["config.json", "model.safetensors"])
+    
+    assert not is_model_cached(MODEL_ID, cache_dir=tmp_path)
+
+
+@pytest.mark.parametrize("weights", ["model.safetensors", "pytorch_model.bin"])
+def test_is_model_cached_complete(tmp_path, weights):
+    """Test that config, preprocessor config and either weights format count as cached."""
+    _fake_snapshot(tmp_path, ["config.json", "preprocessor_config.json", weights])
+    
+    assert is_model_cached(MODEL_ID, cache_dir=tmp_path)
+
+
+def test_is_model_cached_without_weights(tmp_path):
+    """Test that an interrupted download without weights is not complete."""
+    _fake_snapshot(tmp_path, ["config.json", "preprocessor_config.json"])
+    
+    assert not is_model_cached(MODEL_ID, cache_dir=tmp_path)
+
+
+def test_is_model_cached_missing(tmp_path):
+    """Test that an unknown model is not cached."""
+    assert not is_model_cached(MODEL_ID, cache_dir=tmp_path)
+
+
+def test_bf16_on_gpu_without_bf16_falls_back():
+    """Test that bf16 is not reported for a GPU that loads in fp16."""
+    assert _resolve_quantization("bf16", "cuda:0", torch.float16) == ("none", torch.float16)
+    assert _resolve_quantization("bf16", "cuda:0", torch.bfloat16) == ("bf16", torch.bfloat16)
+
+
+def test_traced_vision_path_is_in_snapshot(tmp_path):
+    """Test that the trace is saved in the snapshot, named after the library versions."""
+    _fake_snapshot(tmp_path, ["config.json"])
+    
+    path = _traced_vision_path(MODEL_ID, "cuda:0", torch.float16, tmp_path)
+    
+    assert path.parent == tmp_path / "models--org--name" / "snapshots" / "abc123"
+    assert path.name.startswith("traced_vision_cuda_0_float16_torch")
+    assert f"transformers{transformers.__version__}" in path.name
+
+
+def test_traced_vision_path_without_snapshot(tmp_path):
+    """Test that nothing is saved for a model missing from the cache."""
+    assert _traced_vision_path(MODEL_ID, "cpu", torch.float32, tmp_path) is None
+
+
+@pytest.fixture
+def fake_loads(monkeypatch):
+    """Replace model loading with tiny modules and record each load's model type."""
+    loads = []
+    
+    def fake_load_and_prepare(model_type, *args):
+        loads.append(model_type)
+        return torch.nn.Linear(1, 1), object()
+    
+    monkeypatch.setattr(model_manager, "_MODEL_CACHE", {})
+    monkeypatch.setattr(model_manager, "_load_and_prepare", fake_load_and_prepare)
+    return loads
+
+
+def test_load_model_reuses_cached_model(fake_loads):
+    """Test that repeated calls with the same settings load the model once."""
+    first = load_model(device="cpu", model_type="blip")
+    second = load_model(device="cpu", model_type="blip")
+    
+    assert fake_loads == ["blip"]
+    assert second[0] is first[0]
+
+
+def test_load_model_reloads_only_moved_model(fake_loads):
+    """Test that a model moved off its device is reloaded without evicting the others."""
+    blip, _, _ = load_model(device="cpu", model_type="blip")
+    florence, _, _ = load_model(device="cpu", model_type="florence")
+    blip.to("meta")
+    
+    reloaded, _, _ = load_model(device="cpu", model_type="blip")
+    
+    assert reloaded is not blip
+    assert load_model(device="cpu", model_type="florence")[0] is florence
+    assert fake_loads == ["blip", "florence", "blip"]
+
+
+def test_load_model_evicts_least_recently_used(fake_loads, monkeypatch):
+    """Test that the cache drops the least recently used model when full."""
+    monkeypatch.setattr(model_manager, "_MODEL_CACHE_SIZE", 1)
+    
+    load_model(device="cpu", model_type="blip")
+    load_model(device="cpu", model_type="florence")
+    load_model(device="cpu", model_type="blip")
+    
+    assert fake_loads == ["blip", "florence", "blip"]
+
+
+@pytest.fixture
+def restore_sharing_strategy():
+    """Put back the process-wide tensor sharing strategy after the test."""
+    strategy = mp.get_sharing_strategy()
+    yield
+    mp.set_sharing_strategy(strategy)
+
+
+def test_load_shared_model_on_cpu(fake_loads, restore_sharing_strategy):
+    """Test that CPU weights move to shared memory with the file_system strategy."""
+    model, _, device_str = load_shared_model(device="cpu", model_type="blip")
+    
+    assert device_str == "cpu"
+    assert all(param.is_shared() for param in model.parameters())
+    assert mp.get_sharing_strategy() == "file_system"
+    assert fake_loads == ["blip"]
+
+
+def test_compile_model_falls_back_when_compile_is_unavailable(monkeypatch):
+    """Test that a torch build refusing to compile leaves the model eager."""
+    def refuse(self, *args, **kwargs):
+        raise RuntimeError("Python 3.12+ not yet supported for torch.compile")
+    
+    monkeypatch.setattr(torch.nn.Module, "compile", refuse)
+    model = torch.nn.Module()
+    model.vision_model = torch.nn.Linear(1, 1)
+    model.text_decoder = torch.nn.Linear(1, 1)
+    
+    _compile_model(model, "blip", "cpu")
+    
+    assert not model._is_compiled
@@ -0,0 +1,74 @@
+"""
+Tests for utility functions.
+"""
+
+import pytest
+
+from lora_captioner.utils import count_images, format_file_size
+
+
+@pytest.mark.parametrize(
+    "size_bytes, expected",
+    [
+        (0, "0.0 B"),
+        (1, "1.0 B"),
+        (1023, "1023.0 B"),
+        (1024, "1.0 KB"),
+        (1536, "1.5 KB"),
+        (1024**2 - 1, "1024.0 KB"),
+        (1024**3, "1.0 GB"),
+        (1024**5, "1.0 PB"),
+        (1024**6, "1024.0 PB"),
+    ],
+)
+def test_format_file_size(size_bytes, expected):
+    """Test unit selection at the unit boundaries, up to the PB cap."""
+    assert format_file_size(size_bytes) == expected
+
+
+def test_format_file_size_negative():
+    """Test that negative sizes are shown in bytes."""
+    assert format_file_size(-5) == "-5.0 B"
+    assert format_file_size(-2048) == "-2048.0 B"
+
+
+def test_format_file_size_float():
+    """Test that fractional sizes are accepted."""
+    assert format_file_size(0.5) == "0.5 B"
+    assert format_file_size(1500.5) == "1.5 KB"
+
+
+@pytest.fixture
+def image_dir(tmp_path):
+    """A directory with 5 images plus files and folders that must not be counted."""
+    for name in ["a.jpg", "b.PNG", "c.webp", "d.tif", "e.jpeg", "notes.txt", ".jpg"]:
+        (tmp_path / name).touch()
+    (tmp_path / "x.jpg").mkdir()
+    (tmp_path / "sub").mkdir()
+    (tmp_path / "sub" / "f.png").touch()
+    return tmp_path
+
+
+def test_count_images(image_dir):
+    """Test that only supported image files directly in the directory are counted."""
+    assert count_images(image_dir) == 5
+    assert count_images(image_dir, cap=None) == 5
+
+
+def test_count_images_cap(image_dir):
+    """Test that counting stops at the cap."""
+    assert count_images(image_dir, cap=3) == 3
+    assert count_images(image_dir, cap=5) == 5
+    assert count_images(image_dir, cap=50) == 5
+
+
+def test_count_images_cap_zero(image_dir):
+    """Test that a cap of 0 returns 0 without counting."""
+    assert count_images(image_dir, cap=0) == 0
+
+
+def test_count_images_skips_directories(tmp_path):
+    """Test that a directory named like an image is not counted."""
+    (tmp_path / "x.jpg").mkdir()
+    
+    assert count_images(tmp_path) == 0